@@ -4,6 +4,8 @@ HARBOURMASTER_VERSION = '0.4.11'
 from .config import (
     HM_DEFAULT_PORTS_DIR,
     HM_DEFAULT_TOOLS_DIR,
+    HM_EXTRACT_BUFFER_SIZE,
+    HM_EXTRACT_WORKERS,
     HM_GENRES,
     HM_PORTS_DIR,
     HM_SOURCE_DEFAULTS,
@@ -16,15 +18,18 @@ from .util import (
     Callback,
     CancelEvent,
     HarbourException,
+    QueuedCallback,
     add_dict_list_unique,
     add_list_unique,
     add_pm_signature,
+    capabilities_mask,
     datetime_compare,
     download,
     fetch_data,
     fetch_json,
     fetch_text,
     get_dict_list,
+    get_path_free,
     get_path_fs,
     hash_file,
     json_safe_load,
@@ -42,7 +47,14 @@ from .util import (
     version_parse,
     )
 
+from .mounts import (
+    HM_MOUNTS,
+    MountTable,
+    )
+
 from .info import (
+    PortRecord,
+    port_info_json,
     port_info_load,
     port_info_merge,
     )
@@ -68,10 +80,41 @@ from .captain import (
     check_port,
     )
 
+from .extract import (
+    zip_copy,
+    zip_extract,
+    )
+
+from .manifest import (
+    file_crc32,
+    manifest_load,
+    manifest_size,
+    )
+
+from .fifo import (
+    FifoReader,
+    )
+
+from .fragments import (
+    PortFragments,
+    ports_json_fragment,
+    ports_json_write,
+    )
+
+from .search import (
+    SearchIndex,
+    SearchQuery,
+    search_words,
+    )
+
 from .harbour import (
     HarbourMaster,
     )
 
+from .server import (
+    HarbourServer,
+    )
+
 __all__ = (
     'HarbourMaster',
     )
@@ -30,9 +30,12 @@ def check_port(port_name, zip_file, extra_info=None):
     dirs = []
 
     port_info_file = None
+    install_size = 0
 
     with zipfile.ZipFile(zip_file, 'r') as zf:
         for file_info in zf.infolist():
+            install_size += file_info.file_size
+
             if file_info.filename.startswith('/'):
                 ## Sneaky
                 logger.error(f"Port {port_name} has an illegal file {file_info.filename!r}, aborting.")
@@ -108,6 +111,7 @@ def check_port(port_name, zip_file, extra_info=None):
 
     if extra_info is not None:
         extra_info['port_info_file'] = port_info_file
+        extra_info['install_size'] = install_size
 
     return port_info
 
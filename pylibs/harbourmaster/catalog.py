@@ -0,0 +1,161 @@
+
+# System imports
+import collections
+import fnmatch
+
+# Included imports
+
+from loguru import logger
+
+# Module imports
+from .config import *
+from .util import *
+
+
+################################################################################
+## Merged port catalog
+CatalogEntry = collections.namedtuple('CatalogEntry', (
+    'port_source',      # First source that lists it as a port.
+    'port_info',        # port_info from port_source.
+    'asset_source',     # First source that lists it as a port or util, this is where it downloads from.
+    'asset',            # {'name', 'size', 'url'} from asset_source.
+    'images',           # {image_type: Path} from the first source that has images for it.
+    'install_source',   # First source that can install it, this includes themes and PortMaster.zip.
+    ))
+
+
+def source_names(source):
+    """
+    Returns (ports, utils, images, installable) name sets of a source.
+    """
+    ports = set(getattr(source, 'ports', []))
+    utils = set(getattr(source, 'utils', []))
+    images = set(getattr(source, 'images', {}))
+    installable = set(ports)
+
+    for name in getattr(source, '_data', {}):
+        if name.endswith('.theme.zip'):
+            installable.add(name)
+
+        elif name == 'portmaster.zip' and source.name in ("PortMaster", ):
+            installable.add(name)
+
+    return ports, utils, images, installable
+
+
+class PortCatalog():
+    """
+    All the sources merged into one name -> CatalogEntry dict, with the source priority already worked out.
+
+    When a source changes only the names it had before or has now are resolved again, and that is
+    put off until the next lookup.
+    """
+    def __init__(self, hm):
+        self.hm = hm
+        self._entries = {}
+        self._names = {}
+        self._dirty = set()
+
+    def source_changed(self, source_prefix):
+        self._dirty.add(source_prefix)
+
+    def refresh(self):
+        for source_prefix in self.hm.sources:
+            if source_prefix not in self._names:
+                self._dirty.add(source_prefix)
+
+        if len(self._dirty) == 0:
+            return
+
+        dirty, self._dirty = self._dirty, set()
+        changed = set()
+
+        for source_prefix in dirty:
+            for names in self._names.pop(source_prefix, ()):
+                changed.update(names)
+
+            source = self.hm.sources.get(source_prefix, None)
+            if source is None:
+                continue
+
+            self._names[source_prefix] = source_names(source)
+            for names in self._names[source_prefix]:
+                changed.update(names)
+
+        for name in changed:
+            self._resolve(name)
+
+        logger.debug(f"PortCatalog: resolved {len(changed)} names from {', '.join(sorted(dirty))}.")
+
+    def _resolve(self, name):
+        port_source = asset_source = image_source = install_source = None
+
+        for source_prefix, source in self.hm.sources.items():
+            ports, utils, images, installable = self._names[source_prefix]
+
+            if port_source is None and name in ports:
+                port_source = source
+
+            if asset_source is None and (name in ports or name in utils):
+                asset_source = source
+
+            if image_source is None and name in images:
+                image_source = source
+
+            if install_source is None and name in installable:
+                install_source = source
+
+        if port_source is None and asset_source is None and image_source is None and install_source is None:
+            self._entries.pop(name, None)
+            return
+
+        port_info = None
+        if port_source is not None:
+            port_info = port_source.port_info(name)
+
+        asset = None
+        if asset_source is not None:
+            asset = getattr(asset_source, '_data', {}).get(name, None)
+
+        images = None
+        if image_source is not None:
+            images = {
+                image_type: (image_source._images_dir / image_file)
+                for image_type, image_file in image_source.images[name].items()}
+
+        self._entries[name] = CatalogEntry(port_source, port_info, asset_source, asset, images, install_source)
+
+    def get(self, port_name):
+        """
+        Returns the CatalogEntry for port_name, or None.
+        """
+        self.refresh()
+
+        return self._entries.get(name_cleaner(port_name), None)
+
+    def install_source(self, port_name, repo='*'):
+        """
+        Returns the first source with a prefix matching repo that can install port_name, or None.
+        """
+        self.refresh()
+
+        name = name_cleaner(port_name)
+
+        if repo == '*':
+            entry = self._entries.get(name, None)
+            if entry is None:
+                return None
+
+            return entry.install_source
+
+        for source_prefix, source in self.hm.sources.items():
+            if fnmatch.fnmatch(source_prefix, repo) and name in self._names[source_prefix][3]:
+                return source
+
+        return None
+
+
+__all__ = (
+    'CatalogEntry',
+    'PortCatalog',
+    )
@@ -22,6 +22,24 @@ HM_UPDATE_FREQUENCY=(60 * 60 * 1)  # Only check automatically once per hour.
 HM_TESTING=False
 HM_PERFTEST=False
 
+## Zip extraction, small files are batched together until they reach HM_EXTRACT_BATCH_SIZE bytes.
+HM_EXTRACT_WORKERS=min(4, os.cpu_count() or 1)
+HM_EXTRACT_BATCH_SIZE=(1024 * 1024)
+HM_EXTRACT_BATCH_FILES=64
+HM_EXTRACT_BUFFER_SIZE=(256 * 1024)
+
+## SD cards do not like lots of readers at once.
+HM_VERIFY_WORKERS=2
+
+## How many runtimes get downloaded at once.
+HM_DOWNLOAD_WORKERS=3
+
+## Removing ports is mostly waiting on the filesystem.
+HM_UNINSTALL_WORKERS=min(4, os.cpu_count() or 1)
+
+## How many list_ports results to keep around.
+HM_LIST_CACHE_SIZE=32
+
 ################################################################################
 ## The following code is a simplification of the PortMaster toolsloc and whichsd code.
 HM_DEFAULT_PORTS_DIR = Path("/roms/ports")
@@ -80,6 +98,18 @@ else:
 if 'HM_PERFTEST' in os.environ:
     HM_PERFTEST=True
 
+if 'HM_EXTRACT_WORKERS' in os.environ:
+    HM_EXTRACT_WORKERS=max(1, int(os.environ['HM_EXTRACT_WORKERS']))
+
+if 'HM_VERIFY_WORKERS' in os.environ:
+    HM_VERIFY_WORKERS=max(1, int(os.environ['HM_VERIFY_WORKERS']))
+
+if 'HM_DOWNLOAD_WORKERS' in os.environ:
+    HM_DOWNLOAD_WORKERS=max(1, int(os.environ['HM_DOWNLOAD_WORKERS']))
+
+if 'HM_UNINSTALL_WORKERS' in os.environ:
+    HM_UNINSTALL_WORKERS=max(1, int(os.environ['HM_UNINSTALL_WORKERS']))
+
 
 HM_SOURCE_DEFAULTS = {
     "020_portmaster.source.json": textwrap.dedent("""
@@ -136,4 +166,12 @@ __all__ = (
     'HM_SOURCE_DEFAULTS',
     'HM_TESTING',
     'HM_PERFTEST',
+    'HM_EXTRACT_WORKERS',
+    'HM_EXTRACT_BATCH_SIZE',
+    'HM_EXTRACT_BATCH_FILES',
+    'HM_EXTRACT_BUFFER_SIZE',
+    'HM_VERIFY_WORKERS',
+    'HM_DOWNLOAD_WORKERS',
+    'HM_UNINSTALL_WORKERS',
+    'HM_LIST_CACHE_SIZE',
     )
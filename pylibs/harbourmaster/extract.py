@@ -0,0 +1,193 @@
+
+# System imports
+import concurrent.futures
+import threading
+import zipfile
+
+from gettext import gettext as _
+from pathlib import Path
+
+# Included imports
+
+from loguru import logger
+
+# Module imports
+from .config import *
+from .util import *
+
+
+################################################################################
+## Zip extraction
+def zip_target(dest_dir, file_info):
+    """
+    Returns the destination path for a zip entry, refuses anything that would escape dest_dir.
+    """
+    file_name = file_info.filename.replace('\\', '/')
+
+    if file_name.startswith('/') or '..' in file_name.split('/'):
+        logger.error(f"Illegal file {file_info.filename!r} in zip, aborting.")
+        raise HarbourException(f"Illegal file {file_info.filename!r}")
+
+    return dest_dir / file_name
+
+
+def zip_copy(zf, file_info, file_name, buffer=None):
+    """
+    Streams a single zip entry into file_name through a fixed size buffer.
+
+    Pass the same buffer in for every entry to avoid allocating a new one each time.
+    """
+    if buffer is None:
+        buffer = bytearray(HM_EXTRACT_BUFFER_SIZE)
+
+    view = memoryview(buffer)
+
+    with zf.open(file_info, 'r') as in_fh, open(file_name, 'wb') as out_fh:
+        while True:
+            length = in_fh.readinto(view)
+            if not length:
+                break
+
+            out_fh.write(view[:length])
+
+
+def _zip_batches(file_infos):
+    """
+    Groups zip entries into batches, large files get a batch to themselves.
+    """
+    batch = []
+    batch_size = 0
+
+    for file_info in file_infos:
+        if file_info.file_size >= HM_EXTRACT_BATCH_SIZE:
+            yield [file_info]
+            continue
+
+        batch.append(file_info)
+        batch_size += file_info.file_size
+
+        if batch_size >= HM_EXTRACT_BATCH_SIZE or len(batch) >= HM_EXTRACT_BATCH_FILES:
+            yield batch
+            batch = []
+            batch_size = 0
+
+    if len(batch) > 0:
+        yield batch
+
+
+def zip_extract(zip_file, dest_dir, *, file_infos=None, callback=None, created=None, workers=None):
+    """
+    Extracts zip_file into dest_dir, inflating the entries in parallel.
+
+    All the directories are created up front, then the files are split into batches and
+    handed to worker threads, each thread opens its own ZipFile handle.
+
+    Every path that did not exist before extraction is appended to created, in the order it
+    was created, so a failed install can be undone exactly.
+
+    Returns a list of all the extracted paths.
+    """
+    if workers is None:
+        workers = HM_EXTRACT_WORKERS
+
+    if created is None:
+        created = []
+
+    dest_dir = Path(dest_dir)
+
+    with zipfile.ZipFile(zip_file, 'r') as zf:
+        if file_infos is None:
+            file_infos = zf.infolist()
+
+        ## Work out where everything goes first.
+        extracted = []
+        dir_paths = {}
+        file_items = []
+        for file_info in file_infos:
+            target = zip_target(dest_dir, file_info)
+
+            if file_info.is_dir():
+                dir_paths[target] = True
+            else:
+                dir_paths[target.parent] = True
+                file_items.append((file_info, target))
+
+        ## Create the directories, parents first.
+        for dir_path in sorted(dir_paths, key=lambda path: len(path.parts)):
+            missing = []
+            parent = dir_path
+            while not parent.is_dir():
+                missing.append(parent)
+                parent = parent.parent
+
+            for new_dir in reversed(missing):
+                new_dir.mkdir()
+                created.append(new_dir)
+
+            if dir_path != dest_dir:
+                extracted.append(dir_path)
+
+        for file_info, target in file_items:
+            if not target.exists():
+                created.append(target)
+
+            extracted.append(target)
+
+    targets = {
+        file_info.filename: target
+        for file_info, target in file_items}
+
+    local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+
+    def extract_batch(batch):
+        zf = getattr(local, 'zf', None)
+        if zf is None:
+            zf = local.zf = zipfile.ZipFile(zip_file, 'r')
+            local.buffer = bytearray(HM_EXTRACT_BUFFER_SIZE)
+            with handles_lock:
+                handles.append(zf)
+
+        for file_info in batch:
+            zip_copy(zf, file_info, targets[file_info.filename], local.buffer)
+
+        return batch
+
+    total_files = len(file_items)
+    done_files = 0
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(extract_batch, batch)
+                for batch in _zip_batches([file_info for file_info, target in file_items])]
+
+            try:
+                ## Progress is reported from this thread only, once per batch.
+                for future in concurrent.futures.as_completed(futures):
+                    batch = future.result()
+                    done_files += len(batch)
+
+                    if callback is not None:
+                        callback.progress(_("Installing"), done_files, total_files, '%')
+                        callback.message(f"- {batch[0].filename}")
+
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+
+                raise
+
+    finally:
+        for zf in handles:
+            zf.close()
+
+    return extracted
+
+
+__all__ = (
+    'zip_copy',
+    'zip_target',
+    'zip_extract',
+    )
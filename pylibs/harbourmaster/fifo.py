@@ -0,0 +1,154 @@
+
+# System imports
+import os
+import queue
+import selectors
+import threading
+
+from pathlib import Path
+
+# Included imports
+
+from loguru import logger
+
+# Module imports
+from .config import *
+from .util import *
+
+
+################################################################################
+## Fifo reading
+FIFO_READ_SIZE = 4096
+
+
+class FifoReader():
+    """
+    Reads lines from a fifo, sleeping until there is something to read.
+
+    Each writer closing the fifo counts as the end of a line, so `printf "exit" > fifo` works without
+    a newline. The fifo is then opened again, otherwise it would show as readable forever.
+    """
+    def __init__(self, fifo_file):
+        self.fifo_file = Path(fifo_file)
+        self.selector = selectors.DefaultSelector()
+        self.buffer = bytearray()
+        self.fd = None
+        self.queue = None
+        self.closed = False
+        self._open()
+
+    def _open(self):
+        self.fd = os.open(self.fifo_file, os.O_RDONLY | os.O_NONBLOCK)
+        self.selector.register(self.fd, selectors.EVENT_READ)
+
+    def _reopen(self):
+        self.selector.unregister(self.fd)
+        os.close(self.fd)
+        self._open()
+
+    def _read(self):
+        """
+        Reads whatever is waiting, returns the lines it completed.
+        """
+        lines = []
+
+        while True:
+            try:
+                data = os.read(self.fd, FIFO_READ_SIZE)
+
+            except BlockingIOError:
+                break
+
+            if len(data) == 0:
+                ## All the writers are gone.
+                if len(self.buffer) > 0 and not self.buffer.endswith(b'\n'):
+                    self.buffer += b'\n'
+
+                self._reopen()
+                break
+
+            self.buffer += data
+
+        start = 0
+        while True:
+            end = self.buffer.find(b'\n', start)
+            if end == -1:
+                break
+
+            lines.append(self.buffer[start:end].decode('utf-8', errors='replace'))
+            start = end + 1
+
+        del self.buffer[:start]
+
+        return lines
+
+    def lines(self, timeout=None):
+        """
+        Yields lines as they arrive, or None whenever timeout seconds pass without any.
+        """
+        while not self.closed:
+            if len(self.selector.select(timeout)) == 0:
+                yield None
+                continue
+
+            for line in self._read():
+                yield line
+
+    def start(self, wakeup=None):
+        """
+        Reads lines on a background thread instead, collect them with get_line().
+
+        wakeup() is called from that thread whenever new lines are waiting.
+        """
+        self.queue = queue.Queue()
+
+        def reader():
+            try:
+                for line in self.lines():
+                    self.queue.put(line)
+
+                    if wakeup is not None:
+                        wakeup()
+
+            except (OSError, ValueError) as err:
+                if not self.closed:
+                    logger.error(f"Unable to read {self.fifo_file}: {err}")
+
+        threading.Thread(target=reader, daemon=True).start()
+
+    def get_line(self):
+        """
+        Returns the next line read by start(), or None.
+        """
+        try:
+            return self.queue.get_nowait()
+
+        except queue.Empty:
+            return None
+
+    def pending(self):
+        """
+        Returns True if start() has lines waiting.
+        """
+        return not self.queue.empty()
+
+    def close(self):
+        self.closed = True
+
+        if self.fd is not None:
+            self.selector.unregister(self.fd)
+            os.close(self.fd)
+            self.fd = None
+
+        self.selector.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+__all__ = (
+    'FifoReader',
+    )
@@ -0,0 +1,86 @@
+
+# System imports
+import json
+import textwrap
+
+# Included imports
+
+from loguru import logger
+
+# Module imports
+from .config import *
+from .util import *
+
+
+################################################################################
+## Cached output fragments
+class PortFragments():
+    """
+    Keeps the rendered output of each port for portsmd and ports.json, so regenerating them only
+    renders the ports that changed.
+
+    A fragment is reused as long as its key compares equal. The keys hold the PortRecord and
+    CatalogEntry themselves, both are replaced rather than changed when a source updates, so the
+    comparison stops at an identity check for everything that did not change.
+    """
+    def __init__(self):
+        self._cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind, port_name, key, build):
+        cached = self._cache.get((kind, port_name), None)
+        if cached is not None and cached[0] == key:
+            self.hits += 1
+            return cached[1]
+
+        self.misses += 1
+        fragment = build()
+        self._cache[(kind, port_name)] = (key, fragment)
+        return fragment
+
+    def prune(self, kind, port_names):
+        """
+        Forgets the fragments of kind for any port not in port_names.
+        """
+        for cache_key in list(self._cache):
+            if cache_key[0] == kind and cache_key[1] not in port_names:
+                del self._cache[cache_key]
+
+
+def ports_json_fragment(port_info):
+    """
+    A port as it appears in the ports list of ports.json.
+    """
+    return textwrap.indent(json.dumps(port_info, indent=4), ' ' * 8)
+
+
+def ports_json_write(write, fragments, utils):
+    """
+    Writes ports.json one port at a time, the output is the same as json.dump(..., indent=4).
+
+    fragments is an iterable of ports_json_fragment results.
+    """
+    write('{\n    "ports": [')
+
+    first = True
+    for fragment in fragments:
+        write('\n' if first else ',\n')
+        write(fragment)
+        first = False
+
+    if first:
+        write('],\n')
+    else:
+        write('\n    ],\n')
+
+    write('    "utils": ')
+    write(textwrap.indent(json.dumps(utils, indent=4), ' ' * 4).lstrip())
+    write('\n}')
+
+
+__all__ = (
+    'PortFragments',
+    'ports_json_fragment',
+    'ports_json_write',
+    )
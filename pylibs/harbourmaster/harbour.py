@@ -1,13 +1,16 @@
 
 # System imports
-import fnmatch
 import functools
+import itertools
+import collections
+import concurrent.futures
 import datetime
 import json
 import os
 import pathlib
 import shutil
 import subprocess
+import tempfile
 import zipfile
 
 from pathlib import Path
@@ -27,6 +30,13 @@ from .info import *
 from .source import *
 from .platform import *
 from .captain import *
+from .extract import *
+from .manifest import *
+from .owners import *
+from .portindex import *
+from .catalog import *
+from .search import *
+from .fragments import *
 
 ################################################################################
 ## Config loading
@@ -77,8 +87,14 @@ class HarbourMaster():
         self.themes_dir = tools_dir / "PortMaster" / "themes"
         self.ports_dir  = ports_dir
         self.cfg_file   = self.cfg_dir / "config.json"
+        self.owners     = OwnerIndex(self.cfg_dir / "owners.json")
 
         self.sources = {}
+        self.port_index = PortIndex(self)
+        self.catalog = PortCatalog(self)
+        self.port_fragments = PortFragments()
+        self._list_cache = collections.OrderedDict()
+        self._search_indexes = {}
         self.config = {
             'no-check': config.get('no-check', False),
             'offline': config.get('offline', False),
@@ -235,6 +251,15 @@ class HarbourMaster():
 
             self.sources[source_data['prefix']] = source
 
+        self.catalog.refresh()
+
+    def source_changed(self, source_prefix):
+        """
+        Called by a source whenever it has been loaded or updated.
+        """
+        self.port_index.sources_changed()
+        self.catalog.source_changed(source_prefix)
+        self._search_indexes.pop(source_prefix, None)
 
     def _get_pm_signature(self, file_name):
         """
@@ -443,6 +468,10 @@ class HarbourMaster():
                     ):
                 continue
 
+            ## Left behind by an install that never finished.
+            if file_item.name.startswith('.hm-staging-'):
+                continue
+
             file_name = file_item.name
             if file_item.is_dir():
                 file_name += '/'
@@ -654,36 +683,21 @@ class HarbourMaster():
                 else:
                     logger.debug(f"Unable to dump {str(ports_files[port_name])}: {port_info}")
 
-    def port_info_attrs(self, port_info):
-        runtime_fix = {
-            'frt':  'godot',
-            'mono': 'mono',
-            'jdk11': 'jre',
-            }
-
-        attrs = []
-        runtime = port_info.get('attr', {}).get('runtime', None)
-        if runtime is not None:
-            for runtime_key, runtime_attr in runtime_fix.items():
-                if runtime_key in runtime:
-                    add_list_unique(attrs, runtime_attr)
-
-        for genre in port_info.get('attr', {}).get('genres', []):
-            add_list_unique(attrs, genre.casefold())
+        self.owners.reconcile(all_ports)
 
-        for porter in port_info.get('attr', {}).get('porter', []):
-            add_list_unique(attrs, porter.casefold())
+        self.port_index.installed_changed()
 
-        rtr = port_info.get('attr', {}).get('rtr', False)
-        if rtr:
-            add_list_unique(attrs, 'rtr')
+    def port_info_attrs(self, port_info):
+        attrs = port_attrs(port_info)
 
         if port_info['name'].casefold() in self.installed_ports:
-            add_list_unique(attrs, 'installed')
+            attrs.append('installed')
 
         if port_info['name'].casefold() in self.broken_ports:
-            add_list_unique(attrs, 'installed')
-            add_list_unique(attrs, 'broken')
+            if 'installed' not in attrs:
+                attrs.append('installed')
+
+            attrs.append('broken')
 
         return attrs
 
@@ -707,60 +721,114 @@ class HarbourMaster():
 
         return match_requirements(capabilities, requirements)
 
+    @property
+    def catalog_version(self):
+        """
+        Changes every time a source is updated or a port is installed/uninstalled.
+        """
+        return self.port_index.version
+
     def list_ports(self, filters=[]):
         ## Filters can be genre, runtime
 
-        tmp_ports = {}
-        not_installed = 'not installed' in filters
-        if not_installed:
-            filters = list(filters)
-            filters.remove('not installed')
+        cache_key = (tuple(filters), self.port_index.version)
 
-        if 'installed' in filters:
-            for port_name, port_info in self.installed_ports.items():
-                if port_name.casefold() in tmp_ports:
-                    continue
+        if cache_key in self._list_cache:
+            self._list_cache.move_to_end(cache_key)
+            return dict(self._list_cache[cache_key])
 
-                if not self.match_filters(filters, port_info):
-                    continue
+        ports = self.port_index.query_sorted(filters)
 
-                tmp_ports[port_name.casefold()] = port_info
+        self._list_cache[cache_key] = ports
+        while len(self._list_cache) > HM_LIST_CACHE_SIZE:
+            self._list_cache.popitem(last=False)
 
-            for port_name, port_info in self.broken_ports.items():
-                if port_name.casefold() in tmp_ports:
-                    continue
+        return dict(ports)
 
-                if not self.match_filters(filters, port_info):
-                    continue
+    def iter_ports(self, filters=[], *, sort_key='title', reverse=False, offset=0, limit=None, fields=None):
+        """
+        Generator version of list_ports, yields (port_name, port_info).
 
-                tmp_ports[port_name.casefold()] = port_info
+        sort_key is 'title' for the list_ports order, 'name', None for no particular order, or a function
+        taking (port_name, port_info). offset and limit select a page of the results, and fields cuts
+        each port_info down to just those keys (see port_info_project).
+        """
+        if sort_key == 'title':
+            ports = self.port_index.iter_sorted(filters)
+            if reverse:
+                ports = reversed(list(ports))
 
-        for source_prefix, source in self.sources.items():
-            for port_name in source.ports:
-                if not_installed and (
-                        port_name.casefold() in self.installed_ports.keys() or
-                        port_name.casefold() in self.broken_ports.keys()):
-                    continue
+        elif sort_key is None:
+            ports = self.port_index.query(filters).items()
 
-                if port_name.casefold() in tmp_ports:
-                    continue
+        elif sort_key == 'name':
+            ports = sorted(self.port_index.query(filters).items(), reverse=reverse)
 
-                port_info = source.port_info(port_name)
+        else:
+            ports = sorted(
+                self.port_index.query(filters).items(),
+                key=lambda item: sort_key(*item),
+                reverse=reverse)
 
-                if not self.match_filters(filters, port_info):
-                    continue
+        if limit is not None:
+            ports = itertools.islice(ports, offset, offset + limit)
 
-                if not self.match_requirements(port_info):
-                    continue
+        elif offset > 0:
+            ports = itertools.islice(ports, offset, None)
 
-                tmp_ports[port_name.casefold()] = port_info
+        for port_name, port_info in ports:
+            if fields is not None:
+                port_info = port_info_project(port_info, fields)
 
-        ports = {
-            port_name: port_info
-            for port_name, port_info in sorted(tmp_ports.items(), key=lambda x: x[1].get('attr', {}).get('title', x[0]).casefold())
-            }
+            yield port_name, port_info
+
+    def port_facets(self, filters, candidates):
+        """
+        Returns how many ports list_ports(filters + [candidate]) would return for each candidate.
+        """
+        return self.port_index.facets(filters, candidates)
+
+    def _search_index(self, source_prefix, source):
+        ## Saved next to the source file, and only valid for the exact same source data.
+        index_file = source._file_name.with_name(source._file_name.name.replace('.source.json', '.search.json'))
+        revision = f"{source.VERSION}:{source._config.get('last_checked', None)}:{len(source.ports)}"
+
+        index = SearchIndex.load(index_file, revision)
+        if index is None:
+            logger.debug(f"Building search index for {source_prefix}.")
+            index = SearchIndex.build(
+                ((port_name.casefold(), source.port_info(port_name)) for port_name in source.ports),
+                revision)
+
+            index.save(index_file)
+
+        return index
+
+    def search_indexes(self):
+        """
+        Returns the search index of every source, in source order.
+        """
+        for source_prefix, source in self.sources.items():
+            if source_prefix not in self._search_indexes:
+                self._search_indexes[source_prefix] = self._search_index(source_prefix, source)
+
+        return [
+            self._search_indexes[source_prefix]
+            for source_prefix in self.sources]
+
+    def search_query(self, filters=[]):
+        """
+        Returns a SearchQuery, use this when searching as the user types.
+        """
+        return SearchQuery(self, filters)
+
+    def search_ports(self, text, filters=[], limit=None):
+        """
+        Returns the names of the ports matching text, best match first.
 
-        return ports
+        Only ports list_ports(filters) would return are included.
+        """
+        return SearchQuery(self, filters).update(text, limit)
 
     def list_utils(self):
 
@@ -776,13 +844,11 @@ class HarbourMaster():
         return utils
 
     def port_images(self, port_name):
-        for source_prefix, source in self.sources.items():
-            if name_cleaner(port_name) in getattr(source, 'images', {}):
-                return {
-                    image_type: (source._images_dir / image_file)
-                    for image_type, image_file in source.images[name_cleaner(port_name)].items()}
+        entry = self.catalog.get(port_name)
+        if entry is None or entry.images is None:
+            return None
 
-        return None
+        return dict(entry.images)
 
     def porters_list(self):
         return list(self.porters().keys())
@@ -795,33 +861,42 @@ class HarbourMaster():
             if port_name in self.broken_ports:
                 return self.broken_ports[name_cleaner(port_name)]
 
-        for source_prefix, source in self.sources.items():
-            if source.clean_name(port_name) in source.ports:
-                return source.port_info(port_name)
+        entry = self.catalog.get(port_name)
+        if entry is None:
+            return None
 
-        return None
+        return entry.port_info
 
     def port_download_size(self, port_name, check_runtime=True):
-        for source_prefix, source in self.sources.items():
-            clean_name = source.clean_name(port_name)
-            if clean_name not in source.ports:
-                if clean_name not in source.utils:
-                    continue
+        """
+        Returns the download size of a port, including its runtime if it is missing.
 
-            return source.port_download_size(port_name, check_runtime)
+        port_name can also be a list of ports, in which case each missing runtime is only counted once.
+        """
+        if isinstance(port_name, (list, tuple, set)):
+            size = sum(
+                self.port_download_size(name, check_runtime=False)
+                for name in port_name)
 
-        return 0
+            if check_runtime:
+                size += sum(
+                    self.port_download_size(runtime)
+                    for runtime in self.missing_runtimes(self.port_runtimes(port_name)))
 
-    def port_download_url(self, port_name):
-        for source_prefix, source in self.sources.items():
-            clean_name = source.clean_name(port_name)
-            if clean_name not in source.ports:
-                if clean_name not in source.utils:
-                    continue
+            return size
+
+        entry = self.catalog.get(port_name)
+        if entry is None or entry.asset_source is None:
+            return 0
 
-            return source.port_download_url(port_name)
+        return entry.asset_source.port_download_size(port_name, check_runtime)
+
+    def port_download_url(self, port_name):
+        entry = self.catalog.get(port_name)
+        if entry is None or entry.asset is None:
+            return None
 
-        return None
+        return entry.asset['url']
 
     def set_gcd_mode(self, mode='standard'):
         self.platform.set_gcd_mode(mode)
@@ -832,7 +907,93 @@ class HarbourMaster():
     def get_gcd_modes(self):
         return self.platform.get_gcd_modes()
 
-    def _fix_permissions(self, path_check=None):
+    def _port_manifest_file(self, port_name):
+        return self.cfg_dir / "manifests" / f"{port_name.casefold()}.manifest.json"
+
+    def port_manifest(self, port_name):
+        """
+        Returns the installed file manifest for a port, or None if it was not installed by us.
+        """
+        return manifest_load(self._port_manifest_file(port_name))
+
+    def verify_port(self, port_name, full=False):
+        """
+        Checks an installed port against its manifest.
+
+        Returns a dict with the ports 'name', its 'status' and the 'missing', 'modified' and 'extra' files.
+        Status is one of 'ok', 'modified', 'no-manifest' or 'unknown'.
+        """
+        port_info = self.installed_ports.get(port_name.casefold(), None)
+        if port_info is None:
+            port_info = self.broken_ports.get(port_name.casefold(), None)
+
+        result = {
+            'name': port_name,
+            'status': 'unknown',
+            'missing': [],
+            'modified': [],
+            'extra': [],
+            }
+
+        if port_info is None:
+            logger.error(f"Unknown port {port_name}")
+            return result
+
+        result['name'] = port_info['name']
+
+        manifest = self.port_manifest(port_name)
+        if manifest is None:
+            ## Installed by hand, all we can do is check the top level items exist.
+            result['status'] = 'no-manifest'
+
+            for item in port_info['files']:
+                for file_name in get_dict_list(port_info['files'], item):
+                    if not (self.ports_dir / file_name).exists():
+                        result['missing'].append(file_name)
+
+            return result
+
+        result.update(manifest_verify(manifest, self.ports_dir, full=full, callback=self.callback))
+
+        if len(result['missing']) > 0 or len(result['modified']) > 0:
+            result['status'] = 'modified'
+
+        else:
+            result['status'] = 'ok'
+
+        return result
+
+    def _save_port_manifest(self, port_info, zip_file):
+        """
+        Records every file the port installed, sizes and crcs come from the zips central directory.
+
+        The scripts and port.json get rewritten after extraction, and again by load_ports, so those
+        are marked as rewritten and verify only checks they exist.
+        """
+        try:
+            manifest = manifest_from_zip(zip_file, port_info['name'])
+
+            changed_files = [port_info['files']['port.json']]
+            for item in port_info['files']:
+                if item.casefold().endswith('.sh') and (self.ports_dir / item).is_file():
+                    changed_files.append(item)
+
+            manifest_rewritten(manifest, self.ports_dir, changed_files)
+            manifest_modes(manifest, self.ports_dir)
+            manifest['installed'] = datetime.datetime.now().timestamp()
+
+            manifest_save(self._port_manifest_file(port_info['name']), manifest)
+
+        except (OSError, zipfile.BadZipFile) as err:
+            ## Not fatal, we just fall back to checking the filesystem.
+            logger.error(f"Unable to save manifest for {port_info['name']}: {err}")
+
+    def _fix_permissions(self, path_check=None, paths=None):
+        """
+        Makes files readable/writable/executable by everyone on ext filesystems.
+
+        Only the given paths are changed, if paths is None everything in path_check is.
+        """
         if path_check is None:
             path_check = self.ports_dir
 
@@ -842,13 +1003,20 @@ class HarbourMaster():
         if path_fs not in ('ext4', 'ext3'):
             return
 
-        try:
-            logger.info(f"Fixing permissions for {path_check}.")
-            subprocess.check_output(['chmod', '-R', '777', str(path_check)])
+        if paths is None:
+            paths = [path_check]
+            for root, dirs, files in os.walk(path_check):
+                paths.extend(
+                    Path(root) / name
+                    for name in (dirs + files))
 
-        except subprocess.CalledProcessError as err:
-            logger.error(f"Failed to fix permissions: {err}")
-            return
+        logger.info(f"Fixing permissions for {path_check}.")
+        for path in paths:
+            try:
+                os.chmod(path, 0o777)
+
+            except OSError as err:
+                logger.error(f"Failed to fix permissions: {err}")
 
     def _install_theme(self, download_file):
         """
@@ -863,6 +1031,7 @@ class HarbourMaster():
         if not theme_dir.is_dir():
             theme_dir.mkdir(0o755)
 
+        buffer = bytearray(HM_EXTRACT_BUFFER_SIZE)
         with zipfile.ZipFile(download_file, 'r') as zf:
             self.callback.message(_("Installing Theme {download_name}.").format(download_name=download_file.name))
 
@@ -875,8 +1044,7 @@ class HarbourMaster():
                 self.callback.message(f"- {file_info.filename}")
 
                 file_name = theme_dir / file_info.filename.rsplit('/', 1)[-1]
-                with open(file_name, 'wb') as fh:
-                    fh.write(zf.read(file_info.filename))
+                zip_copy(zf, file_info, file_name, buffer)
 
         with open(theme_dir / "theme.md5", 'w') as fh:
             fh.write(hash_file(download_file))
@@ -899,27 +1067,32 @@ class HarbourMaster():
         try:
             gcd_mode = self.get_gcd_mode()
 
+            installed_files = []
+            buffer = bytearray(HM_EXTRACT_BUFFER_SIZE)
             with zipfile.ZipFile(download_file, 'r') as zf:
                 self.callback.message(_("Installing {download_name}.").format(download_name="PortMaster"))
 
                 total_files = len(zf.infolist())
                 for file_number, file_info in enumerate(zf.infolist()):
-                    if file_info.file_size == 0:
-                        compress_saving = 100
-                    else:
-                        compress_saving = file_info.compress_size / file_info.file_size * 100
-
                     self.callback.progress(_("Installing"), file_number+1, total_files, '%')
                     self.callback.message(f"- {file_info.filename}")
 
-                    dest_file = self.tools_dir / file_info.filename
+                    dest_file = zip_target(self.tools_dir, file_info)
+
+                    if file_info.is_dir():
+                        dest_file.mkdir(parents=True, exist_ok=True)
+                        installed_files.append(dest_file)
+                        continue
 
-                    # cprint(f"- <b>{file_info.filename!r}</b> <d>[{nice_size(file_info.file_size)} ({compress_saving:.0f}%)]</d>")
-                    zf.extract(file_info, path=self.tools_dir)
+                    dest_file.parent.mkdir(parents=True, exist_ok=True)
+                    zip_copy(zf, file_info, dest_file, buffer)
 
                     if move_bash and dest_file.name.lower().endswith('.sh'):
                         self.callback.message(f"- moving {dest_file} to {self.cfg_dir / dest_file.name}")
                         os.replace(dest_file, self.tools_dir / dest_file.name)
+                        dest_file = self.tools_dir / dest_file.name
+
+                    installed_files.append(dest_file)
 
             self.set_gcd_mode(gcd_mode)
 
@@ -927,21 +1100,231 @@ class HarbourMaster():
 
             self.callback.message_box(_("Port {download_name!r} installed successfully.").format(download_name="PortMaster"))
 
-            self._fix_permissions(self.tools_dir)
+            self._fix_permissions(self.tools_dir, installed_files)
 
         finally:
             ...
 
         return 0
 
-    def _install_port(self, download_info):
+    def _clean_staging(self):
+        """
+        Removes staging directories left behind by an install that never finished (crash, power loss).
+        """
+        for staging_dir in self.ports_dir.glob('.hm-staging-*'):
+            if staging_dir.is_dir() and not staging_dir.is_symlink():
+                logger.info(f"Removing stale {staging_dir}")
+                shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def _staging_commit(self, staging_dir, dest_dir):
+        """
+        Moves everything in staging_dir into dest_dir.
+
+        New top level items are a single rename, existing directories get merged file by file with
+        os.replace so any user files inside them are left alone. Every file that gets replaced is moved
+        aside into staging_dir first, so on failure everything is put back the way it was.
+
+        Returns a list of the top level items that were renamed in wholesale.
+        """
+        moved = []
+        made_dirs = []
+
+        ## (target, original), original is where the file target replaced was moved to, or None.
+        replaced = []
+
+        ## Directories go first so a script is never in place without its data.
+        items = sorted(staging_dir.iterdir(), key=lambda item: (not item.is_dir(), item.name.casefold()))
+
+        backup_dir = staging_dir / '.replaced'
+        backup_dir.mkdir()
+
+        def replace(source, target):
+            if target.is_dir() and not target.is_symlink():
+                logger.error(f"Unable to install {target}, a file and a directory have the same name.")
+                raise HarbourException(f"Unable to install {target}")
+
+            original = None
+            if target.exists() or target.is_symlink():
+                original = backup_dir / str(len(replaced))
+                os.rename(target, original)
+
+            replaced.append((target, original))
+            os.replace(source, target)
+
+        try:
+            for item in items:
+                target = dest_dir / item.name
+
+                if not target.exists() and not target.is_symlink():
+                    os.rename(item, target)
+                    moved.append(target)
+
+                elif item.is_dir() and target.is_dir():
+                    for root, dirs, files in os.walk(item):
+                        root = Path(root)
+                        target_root = target / root.relative_to(item)
+
+                        for dir_name in dirs:
+                            if not (target_root / dir_name).is_dir():
+                                (target_root / dir_name).mkdir()
+                                made_dirs.append(target_root / dir_name)
+
+                        for file_name in files:
+                            replace(root / file_name, target_root / file_name)
+
+                elif item.is_dir() or target.is_dir():
+                    logger.error(f"Unable to install {item.name}, a file and a directory have the same name.")
+                    raise HarbourException(f"Unable to install {item.name}")
+
+                else:
+                    replace(item, target)
+
+        except (OSError, HarbourException) as err:
+            logger.error(f"Unable to move staged files into place: {err}")
+            self.callback.message(_("Installation failed, removing files..."))
+
+            for target, original in replaced[::-1]:
+                try:
+                    if original is None:
+                        target.unlink()
+                    else:
+                        os.replace(original, target)
+
+                except FileNotFoundError:
+                    pass
+
+                except OSError as restore_err:
+                    logger.error(f"Unable to restore {target}: {restore_err}")
+
+            for dir_path in made_dirs[::-1]:
+                try:
+                    dir_path.rmdir()
+
+                except OSError:
+                    pass
+
+            for target in moved[::-1]:
+                if target.is_dir():
+                    shutil.rmtree(target)
+                else:
+                    target.unlink()
+
+            raise HarbourException(f"Unable to move staged files into place: {err}")
+
+        return moved
+
+    def _upgrade_entries(self, zip_file, manifest):
+        """
+        Compares a zips central directory against an installed manifest.
+
+        Returns the zip entries that are new or changed upstream (or missing from disk), and the
+        manifest entries that are no longer in the zip. Files that only changed on disk are left alone.
+        """
+        old_entries = {
+            entry[0]: entry
+            for entry in manifest['files']}
+
+        rewritten = set(manifest.get('rewritten', []))
+
+        changed = []
+        new_names = set()
+
+        with zipfile.ZipFile(zip_file, 'r') as zf:
+            for file_info in zf.infolist():
+                file_name = file_info.filename.replace('\\', '/')
+                new_names.add(file_name)
+
+                ## Manifests include the implied parent directories too.
+                parts = file_name.rstrip('/').split('/')
+                for i in range(1, len(parts)):
+                    new_names.add('/'.join(parts[:i]) + '/')
+
+                if file_info.is_dir():
+                    if not (self.ports_dir / file_name).is_dir():
+                        changed.append(file_info)
+
+                    continue
+
+                old_entry = old_entries.get(file_name, None)
+                if (old_entry is None or
+                        old_entry[1] != file_info.file_size or
+                        old_entry[2] != file_info.CRC):
+                    ## Changed upstream, this replaces any local changes.
+                    changed.append(file_info)
+                    continue
+
+                ## Unchanged upstream, so anything different on disk was done by the user (configs, saves).
+                try:
+                    if (self.ports_dir / file_name).stat().st_size != file_info.file_size and file_name not in rewritten:
+                        logger.info(f"Keeping {file_name}, it was modified after install.")
+
+                except FileNotFoundError:
+                    changed.append(file_info)
+
+        removed = [
+            entry
+            for file_name, entry in old_entries.items()
+            if file_name not in new_names]
+
+        return changed, removed
+
+    def _remove_entries(self, entries, keep_file=None, rewritten=()):
+        """
+        Removes manifest entries that are no longer part of a port, directories are only removed if empty.
+
+        Files the user modified after install are kept, the ones in rewritten were changed by us so
+        they always go.
+        """
+        dir_names = []
+
+        for file_name, size, crc, mode in entries:
+            if file_name == keep_file:
+                continue
+
+            if file_name.endswith('/'):
+                dir_names.append(file_name)
+                continue
+
+            file_path = self.ports_dir / file_name
+            try:
+                if file_name not in rewritten and (
+                        file_path.stat().st_size != size or
+                        (crc is not None and file_crc32(file_path) != crc)):
+                    logger.info(f"Keeping {file_name}, it was modified after install.")
+                    continue
+
+                self.callback.message(f"- removing {file_name}")
+                file_path.unlink()
+
+            except FileNotFoundError:
+                pass
+
+        ## Deepest first, anything with user files in it stays.
+        dir_names.sort(key=lambda dir_name: dir_name.count('/'), reverse=True)
+        for dir_name in dir_names:
+            try:
+                (self.ports_dir / dir_name).rmdir()
+
+            except OSError:
+                pass
+
+    def _install_port(self, download_info, manifest=None):
         """
         Installs a port.
 
+        Everything is extracted into a staging directory inside ports_dir first, once that is complete
+        and the port.json is written the top level scripts/directories are moved into place. If anything
+        goes wrong we only have to remove the staging directory.
+
+        If manifest is the manifest of the installed version, only the files that have changed are
+        extracted and the files that are no longer in the port are removed, anything else is left alone.
+
         We collect a list of top level scripts/directories, this is added to the port.json file.
         """
 
-        undo_data = []
+        staging_dir = None
+        file_infos = None
+        removed = []
         is_successs = False
 
         port_nice_name = download_info.get('attr', {}).get('title', download_info['name'])
@@ -951,36 +1334,38 @@ class HarbourMaster():
             extra_info = {}
             port_info = check_port(download_info['name'], download_info['zip_file'], extra_info)
 
-            port_info_file = self.ports_dir / extra_info['port_info_file']
+            required_size = extra_info['install_size']
 
-            with zipfile.ZipFile(download_info['zip_file'], 'r') as zf:
-                ## TODO: keep a list of installed files for uninstalling?
-                # At this point the port will be installed
-                # Extract all the files to the specified directory
-                # zf.extractall(self.ports_dir)
-                self.callback.message(_("Installing {download_name}.").format(download_name=port_nice_name))
+            if manifest is not None:
+                file_infos, removed = self._upgrade_entries(download_info['zip_file'], manifest)
 
-                total_files = len(zf.infolist())
-                for file_number, file_info in enumerate(zf.infolist()):
-                    if file_info.file_size == 0:
-                        compress_saving = 100
-                    else:
-                        compress_saving = file_info.compress_size / file_info.file_size * 100
+                required_size = sum(
+                    file_info.file_size
+                    for file_info in file_infos)
 
-                    self.callback.progress(_("Installing"), file_number+1, total_files, '%')
-                    self.callback.message(f"- {file_info.filename}")
+                logger.info(f"Upgrading {download_info['name']}: {len(file_infos)} changed, {len(removed)} removed.")
 
-                    dest_file = path=self.ports_dir / file_info.filename
+            ## Make sure it will actually fit before we start.
+            free_space = get_path_free(self.ports_dir)
+            if free_space is not None and required_size > free_space:
+                logger.error(f"Not enough free space to install {download_info['name']}: {required_size} > {free_space}")
+                self.callback.message(_("Not enough free space, {install_size} required but only {free_space} available.").format(
+                    install_size=nice_size(required_size),
+                    free_space=nice_size(free_space)))
+                raise HarbourException("Not enough free space.")
 
-                    if not file_info.filename.endswith('/'):
-                        if not dest_file.parent.is_dir():
-                            add_list_unique(undo_data, dest_file.parent)
+            self.callback.message(_("Installing {download_name}.").format(download_name=port_nice_name))
 
-                    if not dest_file.exists():
-                        add_list_unique(undo_data, dest_file)
+            ## Installs run one at a time, so any staging directory already there is stale.
+            self._clean_staging()
 
-                    # cprint(f"- <b>{file_info.filename!r}</b> <d>[{nice_size(file_info.file_size)} ({compress_saving:.0f}%)]</d>")
-                    zf.extract(file_info, path=self.ports_dir)
+            ## Same filesystem as the ports, so moving things into place is just a rename.
+            staging_dir = Path(tempfile.mkdtemp(prefix='.hm-staging-', dir=self.ports_dir))
+
+            port_info_file = staging_dir / extra_info['port_info_file']
+
+            ## Extracts everything in parallel.
+            staged_files = zip_extract(download_info['zip_file'], staging_dir, file_infos=file_infos, callback=self.callback)
 
             # print(f"Port Info: {port_info}")
             # print(f"Download Info: {download_info}")
@@ -991,65 +1376,81 @@ class HarbourMaster():
             port_info['name'] = name_cleaner(download_info['zip_file'].name)
             port_info['status'] = download_info['status'].copy()
             port_info['status']['status'] = 'Installed'
+            port_info['install_size'] = extra_info['install_size']
 
             port_info['files'] = {
-                'port.json': str(port_info_file.relative_to(self.ports_dir)),
+                'port.json': str(port_info_file.relative_to(staging_dir)),
                 }
 
             # Add all the root dirs/scripts in the port
             for item in port_info['items']:
-                if (self.ports_dir / item).exists():
-                    if item not in get_dict_list(port_info['files'], item):
-                        add_dict_list_unique(port_info['files'], item, item)
+                if not (staging_dir / item).exists() and (manifest is None or not (self.ports_dir / item).exists()):
+                    logger.error(f"Missing {item} after extracting {download_info['name']}.")
+                    raise HarbourException(f"Missing {item}")
 
-                    if item.casefold().endswith('.sh'):
-                        add_pm_signature(self.ports_dir / item, [port_info['name'], item])
+                if item not in get_dict_list(port_info['files'], item):
+                    add_dict_list_unique(port_info['files'], item, item)
 
-            # And any optional ones.
+                if item.casefold().endswith('.sh') and (staging_dir / item).exists():
+                    add_pm_signature(staging_dir / item, [port_info['name'], item])
+
+            # And any optional ones, these may already be installed.
             for item in get_dict_list(port_info, 'items_opt'):
-                if (self.ports_dir / item).exists():
+                if (staging_dir / item).exists() or (self.ports_dir / item).exists():
                     if item not in get_dict_list(port_info['files'], item):
                         add_dict_list_unique(port_info['files'], item, item)
-
-                    if item.casefold().endswith('.sh'):
-                        add_pm_signature(self.ports_dir / item, [port_info['name'], item])
             # print(f"Merged Info: {port_info}")
 
-            if not port_info_file.is_file():
-                add_list_unique(undo_data, port_info_file)
-
+            port_info_file.parent.mkdir(parents=True, exist_ok=True)
             with open(port_info_file, 'w') as fh:
                 json.dump(port_info, fh, indent=4)
 
+            if port_info_file not in staged_files:
+                staged_files.append(port_info_file)
+
+            self.callback.progress(None, None, None)
+            moved = self._staging_commit(staging_dir, self.ports_dir)
+
+            installed_files = [
+                self.ports_dir / staged_file.relative_to(staging_dir)
+                for staged_file in staged_files]
+
+            if len(removed) > 0:
+                self._remove_entries(removed, port_info['files']['port.json'], set(manifest.get('rewritten', [])))
+
+            ## Optional scripts can come from the zip or already be installed, so they get signed in place.
+            for item in get_dict_list(port_info, 'items_opt'):
+                if item.casefold().endswith('.sh') and (self.ports_dir / item).is_file():
+                    add_pm_signature(self.ports_dir / item, [port_info['name'], item])
+
+            self.owners.add_port(port_info['name'], port_info)
+            self.owners.save()
+
+            self.broken_ports.pop(port_info['name'].casefold(), None)
+            self.installed_ports[port_info['name'].casefold()] = port_info
+            self.port_index.port_installed(port_info['name'], port_info)
 
             is_successs = True
 
-            self.platform.port_install(port_info['name'], port_info, undo_data)
+            self.platform.port_install(port_info['name'], port_info, moved)
 
         except HarbourException as err:
             is_successs = False
             pass
 
         finally:
-            if not is_successs:
-                if len(undo_data) > 0:
-                    logger.error("Installation failed, removing installed files.")
-                    self.callback.message(_("Installation failed, removing files..."))
-
-                    for undo_file in undo_data[::-1]:
-                        logger.debug(f"Removing {undo_file.relative_to(self.ports_dir)}")
-                        self.callback.message(f"- {str(undo_file.relative_to(self.ports_dir))}")
-
-                        if undo_file.is_file():
-                            undo_file.unlink()
-
-                        elif undo_file.is_dir():
-                            shutil.rmtree(undo_file)
+            if staging_dir is not None and staging_dir.is_dir():
+                shutil.rmtree(staging_dir, ignore_errors=True)
 
+            if not is_successs:
+                logger.error("Installation failed.")
                 self.callback.message_box(_("Port {download_name} installed failed.").format(download_name=port_nice_name))
                 return 255
 
-        self._fix_permissions()
+        self._fix_permissions(self.ports_dir, installed_files)
+
+        ## After the permissions are fixed, so the modes recorded are the ones installed.
+        self._save_port_manifest(port_info, download_info['zip_file'])
 
         # logger.debug(port_info)
         if port_info['attr'].get('runtime', None) is not None:
@@ -1072,6 +1473,169 @@ class HarbourMaster():
 
         return 0
 
+    def port_runtimes(self, port_names):
+        """
+        Returns the set of runtimes needed by a batch of ports.
+        """
+        runtimes = set()
+
+        for port_name in port_names:
+            if port_name.startswith('http') or port_name.startswith('./') or port_name.startswith('../') or port_name.startswith('/'):
+                ## We don't know until it is downloaded.
+                continue
+
+            if '/' in port_name:
+                port_name = port_name.split('/', 1)[1]
+
+            port_info = self.port_info(port_name)
+            if port_info is None:
+                continue
+
+            runtime = port_info.get('attr', {}).get('runtime', None)
+            if isinstance(runtime, str) and '/' not in runtime:
+                runtimes.add(runtime)
+
+        return runtimes
+
+    def missing_runtimes(self, runtimes):
+        """
+        Returns the runtimes that are not already in the libs dir.
+        """
+        return {
+            runtime
+            for runtime in runtimes
+            if not (self.libs_dir / runtime).is_file()}
+
+    def fetch_runtimes(self, runtimes):
+        """
+        Downloads any missing runtimes concurrently, each runtime is only fetched once.
+
+        The downloads run in worker threads with a QueuedCallback each, the messages and the
+        combined progress are passed on to our callback from this thread.
+
+        Returns a dict of runtime: result, 0 is success.
+        """
+        results = {}
+        downloads = {}
+
+        for runtime in sorted(self.missing_runtimes(runtimes)):
+            for source_prefix, source in self.sources.items():
+                if runtime in source.utils:
+                    downloads[runtime] = source
+                    break
+
+            else:
+                logger.error(f"Unable to find suitable source for {runtime}.")
+                results[runtime] = 255
+
+        if len(downloads) == 0:
+            return results
+
+        if self.config['offline']:
+            cprint(f"Unable to download {', '.join(downloads)} when offline")
+            self.callback.message_box(_("Unable do download a runtime when in offline mode."))
+
+            for runtime in downloads:
+                results[runtime] = 255
+
+            return results
+
+        if not self.libs_dir.is_dir():
+            self.libs_dir.mkdir(0o777)
+
+        total_size = sum(
+            source.port_download_size(runtime)
+            for runtime, source in downloads.items())
+
+        callbacks = {
+            runtime: QueuedCallback()
+            for runtime in downloads}
+
+        self.callback.message(_("Downloading {runtime_count} runtimes - ({download_size}).").format(
+            runtime_count=len(downloads),
+            download_size=nice_size(total_size)))
+
+        def fetch_runtime(runtime):
+            return downloads[runtime].download(runtime, temp_dir=self.libs_dir, callback=callbacks[runtime])
+
+        def report():
+            for runtime_callback in callbacks.values():
+                runtime_callback.drain(self.callback)
+
+            amount = sum(
+                runtime_callback.amount
+                for runtime_callback in callbacks.values())
+
+            self.callback.progress(_("Downloading runtimes."), amount, total_size or None, 'data')
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=HM_DOWNLOAD_WORKERS) as executor:
+            futures = {
+                executor.submit(fetch_runtime, runtime): runtime
+                for runtime in downloads}
+
+            try:
+                pending = set(futures)
+                while len(pending) > 0:
+                    done, pending = concurrent.futures.wait(pending, timeout=0.1)
+                    report()
+
+                    for future in done:
+                        runtime = futures[future]
+
+                        try:
+                            runtime_download = future.result()
+
+                        except Exception as err:
+                            logger.error(f"Unable to download {runtime}: {err}")
+                            runtime_download = None
+
+                        if runtime_download is None:
+                            results[runtime] = 255
+                            continue
+
+                        self.platform.runtime_install(runtime, [runtime_download])
+                        results[runtime] = 0
+
+            except BaseException:
+                ## Cancelled, stop the others as soon as they next report progress.
+                for runtime_callback in callbacks.values():
+                    runtime_callback.do_cancel()
+
+                for future in futures:
+                    future.cancel()
+
+                raise
+
+            finally:
+                executor.shutdown(wait=True)
+
+                ## Don't leave half downloaded runtimes lying around.
+                for runtime in downloads:
+                    if results.get(runtime, 255) != 0 and (self.libs_dir / runtime).is_file():
+                        (self.libs_dir / runtime).unlink()
+
+        self.callback.progress(None, None, None)
+
+        return results
+
+    def install_ports(self, port_names):
+        """
+        Installs a batch of ports, the runtimes they need are all fetched first.
+        """
+        if not self.config['offline']:
+            with self.callback.enable_cancellable(True):
+                self.fetch_runtimes(self.port_runtimes(port_names))
+
+            if self.callback.was_cancelled:
+                return 255
+
+        for port_name in port_names:
+            result = self.install_port(port_name)
+            if result != 0:
+                return result
+
+        return 0
+
     def check_runtime(self, runtime, port_name=None, in_install=False):
         if isinstance(runtime, str):
             if '/' in runtime:
@@ -1201,32 +1765,8 @@ class HarbourMaster():
             repo = '*'
 
         # Otherwise:
-        for source_prefix, source in self.sources.items():
-            if not fnmatch.fnmatch(source_prefix, repo):
-                continue
-
-            check_okay = False
-            # is it a valid port?
-            if not check_okay and (
-                    source.clean_name(port_name) in source.ports):
-                check_okay = True
-
-            # is it PortMaster.zip from the Official PortMaster repo?
-            if not check_okay and (
-                    source.name in ("PortMaster", ) and
-                    source.clean_name(port_name) == 'portmaster.zip' and
-                    source.clean_name(port_name) in source._data):
-                check_okay = True
-
-            # is it a theme?
-            if not check_okay and (
-                    source.clean_name(port_name).endswith('.theme.zip') and
-                    source.clean_name(port_name) in source._data):
-                check_okay = True
-
-            if not check_okay:
-                continue
-
+        source = self.catalog.install_source(port_name, repo)
+        if source is not None:
             if self.config['offline']:
                 cprint(f"Unable to download {port_name} when offline")
                 self.callback.message_box(_("Unable do download a port when in offline mode."))
@@ -1252,83 +1792,230 @@ class HarbourMaster():
         cprint(f"Unable to find a source for <b>{port_name}</b>")
         return 255
 
-    def uninstall_port(self, port_name):
-        port_info = self.installed_ports.get(port_name.casefold(), None)
-        port_loc = self.installed_ports
+    def upgrade_port(self, port_name):
+        """
+        Upgrades an installed port, only the files that have changed get extracted.
+
+        If the port has no manifest it is just installed again.
+        """
+        if '/' in port_name:
+            repo, port_name = port_name.split('/', 1)
+        else:
+            repo = '*'
 
+        port_info = self.installed_ports.get(port_name.casefold(), None)
         if port_info is None:
             port_info = self.broken_ports.get(port_name.casefold(), None)
-            port_loc = self.broken_ports
 
-            if port_info is None:
-                self.callback.message_box(_("Unknown port {port_name}").format(port_name=port_name))
-                logger.error(f"Unknown port {port_name}")
+        if port_info is None:
+            self.callback.message_box(_("Unknown port {port_name}").format(port_name=port_name))
+            logger.error(f"Unknown port {port_name}")
+            return 255
+
+        manifest = self.port_manifest(port_info['name'])
+        if manifest is None:
+            logger.info(f"No manifest for {port_name}, reinstalling it.")
+            return self.install_port(f"{repo}/{port_name}")
+
+        ## Same source install_port would pick.
+        source = self.catalog.install_source(port_name, repo)
+        if source is not None:
+            if self.config['offline']:
+                cprint(f"Unable to download {port_name} when offline")
+                self.callback.message_box(_("Unable do download a port when in offline mode."))
+                return 255
+
+            download_info = source.download(source.clean_name(port_name))
+
+            if download_info is None:
                 return 255
 
-        port_info_name = port_info.get("attr", {}).get("title", port_name)
+            with self.callback.enable_cancellable(False):
+                return self._install_port(download_info, manifest=manifest)
 
-        all_items = {}
+        self.callback.message_box(_("Unable to find a source for {port_name}").format(port_name=port_name))
 
-        # We need to build up a list of all associated files
-        # so we only delete the ones that will no longer be associaed with any ports.
-        for item_name, item_info in self.installed_ports.items():
-            # Add all the root dirs/scripts in the port
-            for item in item_info['files']:
-                if item in ('port.json', ):
-                    continue
+        cprint(f"Unable to find a source for <b>{port_name}</b>")
+        return 255
 
-                for name in get_dict_list(item_info['files'], item):
-                    add_dict_list_unique(all_items, name, item_name)
+    def _remove_port_dir(self, item, manifest=None):
+        """
+        Removes a ports directory, using the manifest if we have one so we don't have to walk it.
 
-        for item_name, item_info in self.broken_ports.items():
-            # Add all the root dirs/scripts in the port
-            for item in item_info['files']:
-                if item in ('port.json', ):
+        Files first, then the directories deepest first, anything the port did not install (saves,
+        configs) is left where it is. Without a manifest the whole directory goes.
+
+        Symlinks (data moved to another card) are never followed, only the link goes.
+        """
+        item_path = self.ports_dir / item
+
+        if item_path.is_symlink():
+            item_path.unlink()
+            return
+
+        if manifest is None:
+            if item_path.is_dir():
+                shutil.rmtree(item_path)
+
+            return
+
+        prefix = item.rstrip('/') + '/'
+        file_names = [
+            entry[0]
+            for entry in manifest['files']
+            if entry[0].startswith(prefix)]
+
+        links = [
+            file_name
+            for file_name in file_names
+            if file_name.endswith('/') and (self.ports_dir / file_name).is_symlink()]
+
+        dir_names = [prefix]
+
+        for file_name in file_names:
+            if any(file_name.startswith(link) for link in links):
+                continue
+
+            if file_name.endswith('/'):
+                dir_names.append(file_name)
+                continue
+
+            try:
+                (self.ports_dir / file_name).unlink()
+
+            except FileNotFoundError:
+                pass
+
+        for link in links:
+            (self.ports_dir / link).unlink()
+
+        ## Deepest first.
+        dir_names.sort(key=lambda dir_name: dir_name.count('/'), reverse=True)
+        for dir_name in dir_names:
+            try:
+                (self.ports_dir / dir_name).rmdir()
+
+            except OSError:
+                pass
+
+        if item_path.is_dir():
+            logger.info(f"Keeping {item}, it has files that were not installed by the port.")
+
+    def uninstall_port(self, port_name):
+        return self.uninstall_ports([port_name])
+
+    def uninstall_ports(self, port_names):
+        """
+        Uninstalls a batch of ports.
+
+        Works out everything that can be deleted once, removes it in parallel, then updates our state.
+        Files still owned by a port outside of the batch are left alone.
+        """
+        port_infos = {}
+
+        for port_name in port_names:
+            port_info = self.installed_ports.get(port_name.casefold(), None)
+
+            if port_info is None:
+                port_info = self.broken_ports.get(port_name.casefold(), None)
+
+                if port_info is None:
+                    self.callback.message_box(_("Unknown port {port_name}").format(port_name=port_name))
+                    logger.error(f"Unknown port {port_name}")
+                    return 255
+
+            port_infos[port_name.casefold()] = port_info
+
+        batch_names = {
+            port_info['name']
+            for port_info in port_infos.values()}
+
+        ## Everything we are going to delete, and which manifest covers it.
+        uninstall_items = {}
+
+        for port_name, port_info in port_infos.items():
+            port_info_name = port_info.get("attr", {}).get("title", port_name)
+
+            cprint(f"Uninstalling <b>{port_info_name}</b>")
+            self.callback.message(_("Removing {port_name}").format(port_name=port_info_name))
+
+            all_port_items = []
+            for port_file in port_info['files']:
+                all_port_items.extend(get_dict_list(port_info['files'], port_file))
+
+            self.platform.port_uninstall(port_name, port_info, all_port_items)
+
+            manifest = self.port_manifest(port_name)
+
+            for item in all_port_items:
+                if item == port_info['files'].get('port.json', None) or item in uninstall_items:
                     continue
 
-                for name in get_dict_list(item_info['files'], item):
-                    add_dict_list_unique(all_items, name, item_name)
+                # Only delete files/scripts with no owners outside of this batch.
+                if len(self.owners.owners(item) - batch_names) > 0:
+                    continue
 
-        # from pprint import pprint
-        # pprint(all_items)
+                uninstall_items[item] = manifest
 
-        # cprint(f"{all_items}")
-        cprint(f"Uninstalling <b>{port_info_name}</b>")
-        self.callback.message(_("Removing {port_name}").format(port_name=port_info_name))
+        def remove_item(item):
+            item_path = self.ports_dir / item
 
-        all_port_items = []
-        for port_file in port_info['files']:
-            all_port_items.extend(get_dict_list(port_info['files'], port_file))
+            if item_path.is_dir() and not item_path.is_symlink():
+                self._remove_port_dir(item, uninstall_items[item])
 
-        ports_dir = self.ports_dir
+            elif item_path.is_file() or item_path.is_symlink():
+                item_path.unlink()
 
-        if not ports_dir.is_absolute():
-            ports_dir = ports_dir.resolve()
+            return item
 
-        uninstall_items = [
+        items = [
             item
-            for item in all_port_items
-            # Only delete files/scripts with only 1 owner.
-            if len(get_dict_list(all_items, item)) == 1]
+            for item in uninstall_items
+            if (self.ports_dir / item).exists() or (self.ports_dir / item).is_symlink()]
 
-        self.platform.port_uninstall(port_name, port_info, all_port_items)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=HM_UNINSTALL_WORKERS) as executor:
+            futures = [
+                executor.submit(remove_item, item)
+                for item in items]
 
-        for item in uninstall_items:
-            item_path = self.ports_dir / item
+            ## Progress is reported from this thread only.
+            for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                try:
+                    item = future.result()
+
+                except OSError as err:
+                    logger.error(f"Unable to remove file: {err}")
+                    continue
 
-            if item_path.exists():
                 cprint(f"- removing {item}")
                 self.callback.message(f"- {item}")
+                self.callback.progress(_("Uninstalling"), done, len(futures), '%')
 
-                if item_path.is_dir():
-                    shutil.rmtree(item_path)
+        self.callback.progress(None, None, None)
 
-                elif item_path.is_file():
-                    item_path.unlink()
+        ## Now update our state in one go.
+        for port_name, port_info in port_infos.items():
+            manifest_file = self._port_manifest_file(port_name)
+            if manifest_file.is_file():
+                manifest_file.unlink()
 
-        self.callback.message_box(_("Successfully uninstalled {port_name}").format(port_name=port_info_name))
+            self.owners.remove_port(port_info['name'])
+
+            self.installed_ports.pop(port_name, None)
+            self.broken_ports.pop(port_name, None)
+            self.port_index.port_uninstalled(port_name)
+
+        self.owners.save()
+
+        if len(port_infos) == 1:
+            port_name, port_info = list(port_infos.items())[0]
+            self.callback.message_box(_("Successfully uninstalled {port_name}").format(
+                port_name=port_info.get("attr", {}).get("title", port_name)))
+
+        else:
+            self.callback.message_box(_("Successfully uninstalled {port_count} ports").format(
+                port_count=len(port_infos)))
 
-        del port_loc[port_name.casefold()]
         return 0
 
     def portmd(self, port_info):
@@ -1,6 +1,9 @@
 
 # System imports
+import collections.abc
 import pathlib
+import re
+import sys
 
 # Included imports
 import utility
@@ -21,6 +24,7 @@ PORT_INFO_ROOT_ATTRS = {
     'attr': {},
     'status': None,
     'files': None,
+    'install_size': None,
     }
 
 PORT_INFO_ATTR_ATTRS = {
@@ -36,6 +40,240 @@ PORT_INFO_ATTR_ATTRS = {
     }
 
 
+################################################################################
+## Port info normaliser
+## port_info_load runs for every port in a source update and every load_ports, so the checks are
+## built once from the tables above instead of being worked out per port.
+
+## Absolute paths, paths that start with or contain '..', and empty names.
+PORT_INFO_BAD_ITEM_RE = re.compile(r'^(?:/|\.\./|$)|/\.\./')
+
+
+def port_info_compile(root_attrs, attr_attrs, genres):
+    """
+    Returns a function that cleans up a port_info dict in a single pass, in the same way for every
+    port, based on the root and attr defaults and the list of known genres.
+
+    Just like the port_info_load it replaces, the 'attr' dict and item lists of the input are fixed
+    in place and shared with the result.
+    """
+    ## Mutable defaults need a new copy for each port.
+    def fields(attrs):
+        return tuple(
+            (key, default, default.copy if isinstance(default, (dict, list)) else None)
+            for key, default in attrs.items())
+
+    root_fields = fields(root_attrs)
+    attr_fields = fields(attr_attrs)
+    genres = frozenset(genres)
+    bad_item = PORT_INFO_BAD_ITEM_RE.search
+
+    def clean_items(items, key):
+        if not any(map(bad_item, items)):
+            return
+
+        good_items = []
+        for item in items:
+            if bad_item(item):
+                logger.error(f"port_info[{key!r}] contains bad name {item!r}")
+            else:
+                good_items.append(item)
+
+        items[:] = good_items
+
+    def normalise(info):
+        # This strips out extra stuff
+        port_info = {}
+
+        for key, default, copy in root_fields:
+            if key in info:
+                port_info[key] = info[key]
+            elif copy is not None:
+                port_info[key] = copy()
+            else:
+                port_info[key] = default
+
+        attr = port_info['attr']
+
+        if isinstance(attr.get('porter'), str):
+            attr['porter'] = [attr['porter']]
+
+        if isinstance(attr.get('reqs', None), dict):
+            attr['reqs'] = list(attr['reqs'])
+
+        for key, default, copy in attr_fields:
+            if key not in attr:
+                attr[key] = default if copy is None else copy()
+
+        if isinstance(port_info['items'], list):
+            clean_items(port_info['items'], 'items')
+
+        if isinstance(port_info['items_opt'], list):
+            clean_items(port_info['items_opt'], 'items_opt')
+
+            if len(port_info['items_opt']) == 0:
+                port_info['items_opt'] = None
+
+        if isinstance(attr['genres'], list):
+            attr['genres'] = [
+                genre
+                for genre in map(str.casefold, attr['genres'])
+                if genre in genres]
+
+        return port_info
+
+    return normalise
+
+
+PORT_INFO_NORMALISE = port_info_compile(PORT_INFO_ROOT_ATTRS, PORT_INFO_ATTR_ATTRS, HM_GENRES)
+
+
+################################################################################
+## Compact port records
+## The source catalogs hold a port_info for every port, as plain dicts that adds up on devices with very
+## little memory. PortRecord holds the same data in slots, lists become tuples of interned strings, and
+## the key order is kept so turning it back into json gives the exact same output.
+
+## Key orders are shared between records, nearly every port has the same one.
+RECORD_KEYS = {}
+
+
+def record_value(value):
+    if isinstance(value, list):
+        return tuple(
+            sys.intern(item) if isinstance(item, str) else item
+            for item in value)
+
+    return value
+
+
+def record_dict_value(value):
+    if isinstance(value, BaseRecord):
+        return value.to_dict()
+
+    if isinstance(value, tuple):
+        return list(value)
+
+    if isinstance(value, dict):
+        return {
+            key: record_dict_value(item)
+            for key, item in value.items()}
+
+    return value
+
+
+class BaseRecord(collections.abc.Mapping):
+    """
+    Read only mapping with its known keys stored in slots, anything else goes in _extra.
+    """
+    __slots__ = ('_keys', '_extra')
+
+    ## key -> slot name, the keys clash with Mapping methods (items) so they can't be used directly.
+    SLOTS = {}
+    INTERN = ()
+
+    def __init__(self, data):
+        keys = tuple(data)
+        self._keys = RECORD_KEYS.setdefault(keys, keys)
+        self._extra = None
+
+        for key, value in data.items():
+            value = self._value(key, value)
+
+            slot = self.SLOTS.get(key, None)
+            if slot is not None:
+                setattr(self, slot, value)
+
+            else:
+                if self._extra is None:
+                    self._extra = {}
+
+                self._extra[key] = value
+
+    def _value(self, key, value):
+        if key in self.INTERN and isinstance(value, str):
+            return sys.intern(value)
+
+        return record_value(value)
+
+    def __getitem__(self, key):
+        slot = self.SLOTS.get(key, None)
+        if slot is not None:
+            try:
+                return getattr(self, slot)
+
+            except AttributeError:
+                raise KeyError(key) from None
+
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.to_dict()!r})"
+
+    def to_dict(self):
+        """
+        Returns a plain mutable dict, the same as what the record was made from.
+        """
+        return {
+            key: record_dict_value(self[key])
+            for key in self._keys}
+
+    copy = to_dict
+
+
+def record_slots(keys):
+    return {
+        key: f"_{key}"
+        for key in keys}
+
+
+class PortAttrRecord(BaseRecord):
+    SLOTS = record_slots(PORT_INFO_ATTR_ATTRS)
+    INTERN = ('runtime', )
+
+    __slots__ = tuple(SLOTS.values())
+
+
+class PortRecord(BaseRecord):
+    SLOTS = record_slots(PORT_INFO_ROOT_ATTRS)
+
+    __slots__ = tuple(SLOTS.values())
+
+    def _value(self, key, value):
+        if key == 'attr' and isinstance(value, dict):
+            return PortAttrRecord(value)
+
+        return super()._value(key, value)
+
+
+def port_records(port_infos):
+    """
+    Converts a {port_name: port_info} dict to PortRecords, anything already converted is kept.
+    """
+    return {
+        port_name: port_info if isinstance(port_info, BaseRecord) else PortRecord(port_info)
+        for port_name, port_info in port_infos.items()}
+
+
+def port_info_json(value):
+    """
+    Use as json.dump(..., default=port_info_json) on anything that can contain a PortRecord.
+    """
+    if isinstance(value, BaseRecord):
+        return value.to_dict()
+
+    raise TypeError(f'Object of type {value.__class__.__name__} is not JSON serializable')
+
+
 @timeit
 def port_info_load(raw_info, source_name=None, do_default=False):
     if isinstance(raw_info, pathlib.PurePath):
@@ -88,6 +326,12 @@ def port_info_load(raw_info, source_name=None, do_default=False):
 
         info = raw_info
 
+    elif isinstance(raw_info, BaseRecord):
+        if source_name is None:
+            source_name = "<record>"
+
+        info = raw_info.to_dict()
+
     else:
         logger.error(f'Unable to load port_info from {source_name!r}: {raw_info!r}')
         if do_default:
@@ -114,98 +358,33 @@ def port_info_load(raw_info, source_name=None, do_default=False):
         if info.get('attr', {}).get('runtime', None) == "blank":
             info['attr']['runtime'] = None
 
-    if isinstance(info.get('attr', {}).get('porter'), str):
-        info['attr']['porter'] = [info['attr']['porter']]
+    return PORT_INFO_NORMALISE(info)
 
-    if isinstance(info.get('attr', {}).get('reqs', None), dict):
-        info['attr']['reqs'] = [
-            key
-            for key in info['attr']['reqs']]
 
-    # This strips out extra stuff
-    port_info = {}
+def port_info_project(port_info, fields):
+    """
+    Returns just the fields of port_info asked for, 'attr.title' style fields pick keys out of attr.
+    """
+    result = {}
 
-    for attr, attr_default in PORT_INFO_ROOT_ATTRS.items():
-        if isinstance(attr_default, (dict, list)):
-            attr_default = attr_default.copy()
-
-        port_info[attr] = info.get(attr, attr_default)
-
-    for attr, attr_default in PORT_INFO_ATTR_ATTRS.items():
-        if isinstance(attr_default, (dict, list)):
-            attr_default = attr_default.copy()
-
-        port_info['attr'][attr] = info.get('attr', {}).get(attr, attr_default)
-
-    if isinstance(port_info['items'], list):
-        i = 0
-        while i < len(port_info['items']):
-            item = port_info['items'][i]
-            if item.startswith('/'):
-                logger.error(f"port_info['items'] contains bad name {item!r}")
-                del port_info['items'][i]
-                continue
-
-            if item.startswith('../'):
-                logger.error(f"port_info['items'] contains bad name {item!r}")
-                del port_info['items'][i]
-                continue
-
-            if '/../' in item:
-                logger.error(f"port_info['items'] contains bad name {item!r}")
-                del port_info['items'][i]
-                continue
-
-            if item == "":
-                logger.error(f"port_info['items'] contains bad name {item!r}")
-                del port_info['items'][i]
-
-            i += 1
-
-    if isinstance(port_info['items_opt'], list):
-        i = 0
-        while i < len(port_info['items_opt']):
-            item = port_info['items_opt'][i]
-            if item.startswith('/'):
-                logger.error(f"port_info['items_opt'] contains bad name {item}")
-                del port_info['items_opt'][i]
-                continue
-
-            if item.startswith('../'):
-                logger.error(f"port_info['items_opt'] contains bad name {item}")
-                del port_info['items_opt'][i]
-                continue
-
-            if '/../' in item:
-                logger.error(f"port_info['items_opt'] contains bad name {item}")
-                del port_info['items_opt'][i]
-                continue
-
-            if item == "":
-                logger.error(f"port_info['items'] contains bad name {item!r}")
-                del port_info['items_opt'][i]
-
-            i += 1
-
-        if port_info['items_opt'] == []:
-            port_info['items_opt'] = None
-
-    if isinstance(port_info['attr'].get('genres', None), list):
-        genres = port_info['attr']['genres']
-        port_info['attr']['genres'] = []
-
-        for genre in genres:
-            if genre.casefold() in HM_GENRES:
-                port_info['attr']['genres'].append(genre.casefold())
+    for field in fields:
+        if '.' in field:
+            key, sub_key = field.split('.', 1)
+            value = port_info.get(key, None)
+            if value is not None and sub_key in value:
+                result.setdefault(key, {})[sub_key] = value[sub_key]
 
-    return port_info
+        elif field in port_info:
+            result[field] = port_info[field]
+
+    return result
 
 
 @timeit
 def port_info_merge(port_info, other):
     if isinstance(other, (str, pathlib.PurePath)):
         other_info = port_info_load(other)
-    elif isinstance(other, dict):
+    elif isinstance(other, (dict, BaseRecord)):
         other_info = other
     else:
         logger.error(f"Unable to merge {other!r}")
@@ -219,7 +398,7 @@ def port_info_merge(port_info, other):
         value_b = other_info[attr]
 
         if value_a is None or value_a == "" or value_a == []:
-            port_info[attr] = value_b
+            port_info[attr] = record_dict_value(value_b)
             continue
 
         if value_b in (True, False) and value_a in (True, False, None):
@@ -230,8 +409,8 @@ def port_info_merge(port_info, other):
             port_info[attr] = value_b
             continue
 
-        if isinstance(value_b, list) and value_a in ([], None):
-            port_info[attr] = value_b[:]
+        if isinstance(value_b, (list, tuple)) and value_a in ([], None):
+            port_info[attr] = list(value_b)
             continue
 
         if isinstance(value_b, dict) and value_a in ({}, None):
@@ -250,8 +429,8 @@ def port_info_merge(port_info, other):
             port_info['attr'][key_b] = value_b
             continue
 
-        if isinstance(value_b, list) and port_info['attr'][key_b] in ([], None):
-            port_info['attr'][key_b] = value_b[:]
+        if isinstance(value_b, (list, tuple)) and port_info['attr'][key_b] in ([], None):
+            port_info['attr'][key_b] = list(value_b)
             continue
 
         if isinstance(value_b, dict) and port_info['attr'][key_b] in ({}, None):
@@ -262,6 +441,11 @@ def port_info_merge(port_info, other):
 
 
 __all__ = (
+    'PortRecord',
+    'port_info_compile',
+    'port_info_json',
     'port_info_load',
     'port_info_merge',
+    'port_info_project',
+    'port_records',
     )
@@ -0,0 +1,315 @@
+
+# System imports
+import concurrent.futures
+import json
+import os
+import threading
+import zipfile
+import zlib
+
+from gettext import gettext as _
+from pathlib import Path
+
+# Included imports
+
+from loguru import logger
+
+# Module imports
+from .config import *
+from .util import *
+from .extract import *
+
+
+################################################################################
+## Installed file manifests
+## A manifest records every path a port installed, relative to the ports dir:
+##
+##     {"version": 1, "name": "portname.zip", "installed": 1700000000.0, "files": [
+##         ["portname/", 0, null, 0],
+##         ["portname/data.bin", 1024, 2596996162, 33188],
+##         ...]}
+##
+## Each entry is [path, size, crc32, mode], directories end in a '/' and have no crc. The mode is
+## the one the file ended up with once installed. The "installed" key is the time the install
+## finished, anything newer than that has been touched.
+##
+## "rewritten" lists the files we change after extraction (port.json, signed scripts), load_ports
+## can change these again at any time so they are only checked to exist.
+
+MANIFEST_VERSION = 1
+
+
+def file_crc32(file_name, buffer=None):
+    """
+    Returns the crc32 of a file, read through a fixed size buffer.
+    """
+    if buffer is None:
+        buffer = bytearray(HM_EXTRACT_BUFFER_SIZE)
+
+    view = memoryview(buffer)
+    crc = 0
+
+    with open(file_name, 'rb') as fh:
+        while True:
+            length = fh.readinto(view)
+            if not length:
+                break
+
+            crc = zlib.crc32(view[:length], crc)
+
+    return crc
+
+
+def manifest_from_zip(zip_file, name):
+    """
+    Builds a manifest straight from the zips central directory, nothing is decompressed.
+    """
+    files = []
+    dirs = set()
+
+    with zipfile.ZipFile(zip_file, 'r') as zf:
+        for file_info in zf.infolist():
+            ## Same validation as extraction.
+            zip_target(Path('.'), file_info)
+
+            file_name = file_info.filename.replace('\\', '/')
+
+            parts = file_name.rstrip('/').split('/')
+            for i in range(1, len(parts)):
+                dirs.add('/'.join(parts[:i]) + '/')
+
+            if file_info.is_dir():
+                dirs.add(file_name)
+                continue
+
+            files.append([file_name, file_info.file_size, file_info.CRC, 0])
+
+    files.extend(
+        [dir_name, 0, None, 0]
+        for dir_name in dirs)
+
+    files.sort(key=lambda entry: entry[0])
+
+    return {
+        'version': MANIFEST_VERSION,
+        'name': name,
+        'files': files,
+        }
+
+
+def manifest_update(manifest, base_dir, file_names):
+    """
+    Recalculates size/crc32/mode for files we changed after extraction, adds them if they are missing.
+    """
+    entries = {
+        entry[0]: entry
+        for entry in manifest['files']}
+
+    for file_name in file_names:
+        file_name = str(file_name)
+        file_path = base_dir / file_name
+
+        stat = file_path.stat()
+
+        entry = entries.get(file_name, None)
+        if entry is None:
+            entry = entries[file_name] = [file_name, 0, None, 0]
+            manifest['files'].append(entry)
+
+        entry[1] = stat.st_size
+        entry[2] = file_crc32(file_path)
+        entry[3] = stat.st_mode
+
+    manifest['files'].sort(key=lambda entry: entry[0])
+
+
+def manifest_rewritten(manifest, base_dir, file_names):
+    """
+    Marks files we rewrite after extraction, the ones from the zip keep its size/crc32 so upgrades
+    can still tell if they changed upstream. Any that are not in the zip are added.
+    """
+    file_names = [
+        str(file_name)
+        for file_name in file_names]
+
+    known = {
+        entry[0]
+        for entry in manifest['files']}
+
+    manifest_update(manifest, base_dir, [
+        file_name
+        for file_name in file_names
+        if file_name not in known])
+
+    manifest['rewritten'] = sorted(set(manifest.get('rewritten', [])) | set(file_names))
+
+
+def manifest_modes(manifest, base_dir):
+    """
+    Records the mode of every file as installed, the zips modes are not applied when extracting.
+    """
+    for entry in manifest['files']:
+        if entry[0].endswith('/'):
+            continue
+
+        try:
+            entry[3] = (base_dir / entry[0]).stat().st_mode
+
+        except FileNotFoundError:
+            pass
+
+
+def manifest_size(manifest):
+    """
+    Total size of all the files in the manifest.
+    """
+    return sum(
+        entry[1]
+        for entry in manifest['files'])
+
+
+def manifest_load(manifest_file):
+    if not manifest_file.is_file():
+        return None
+
+    try:
+        with open(manifest_file, 'r') as fh:
+            manifest = json.load(fh)
+
+    except (OSError, json.decoder.JSONDecodeError) as err:
+        logger.error(f"Unable to load {manifest_file}: {err}")
+        return None
+
+    if not isinstance(manifest, dict) or manifest.get('version', None) != MANIFEST_VERSION:
+        logger.debug(f"Ignoring {manifest_file}, unknown version.")
+        return None
+
+    return manifest
+
+
+def manifest_save(manifest_file, manifest):
+    manifest_file.parent.mkdir(parents=True, exist_ok=True)
+
+    ## Written then renamed, a half written manifest is worse than none.
+    temp_file = manifest_file.with_name(f".{manifest_file.name}.tmp")
+    with open(temp_file, 'w') as fh:
+        json.dump(manifest, fh, separators=(',', ':'))
+
+    os.replace(temp_file, manifest_file)
+
+
+def manifest_verify(manifest, base_dir, *, full=False, workers=None, callback=None):
+    """
+    Checks the installed files against the manifest.
+
+    Sizes and mtimes are checked first, only files that look suspicious get their crc32 checked,
+    unless full is True in which case everything does. The crc pass is done in parallel with at
+    most workers readers at once.
+
+    Returns {'missing': [...], 'modified': [...], 'extra': [...]}.
+    """
+    if workers is None:
+        workers = HM_VERIFY_WORKERS
+
+    installed = manifest.get('installed', None)
+    rewritten = set(manifest.get('rewritten', []))
+
+    missing = []
+    modified = []
+    suspicious = []
+    known = set()
+    top_dirs = set()
+
+    for file_name, size, crc, mode in manifest['files']:
+        known.add(file_name.rstrip('/'))
+        file_path = base_dir / file_name
+
+        if file_name.endswith('/'):
+            if file_name.count('/') == 1:
+                top_dirs.add(file_name)
+
+            if not file_path.is_dir():
+                missing.append(file_name)
+
+            continue
+
+        try:
+            stat = file_path.stat()
+
+        except FileNotFoundError:
+            missing.append(file_name)
+            continue
+
+        if file_name in rewritten:
+            continue
+
+        if stat.st_size != size:
+            modified.append(file_name)
+
+        elif crc is None:
+            continue
+
+        ## FAT only has 2 second mtime resolution.
+        elif full or installed is None or stat.st_mtime > installed + 2:
+            suspicious.append((file_name, crc))
+
+    if len(suspicious) > 0:
+        local = threading.local()
+
+        def check_crc(item):
+            buffer = getattr(local, 'buffer', None)
+            if buffer is None:
+                buffer = local.buffer = bytearray(HM_EXTRACT_BUFFER_SIZE)
+
+            file_name, crc = item
+            try:
+                return file_name, file_crc32(base_dir / file_name, buffer) == crc
+
+            except OSError as err:
+                logger.error(f"Unable to read {file_name}: {err}")
+                return file_name, False
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for done, (file_name, is_ok) in enumerate(executor.map(check_crc, suspicious), 1):
+                if not is_ok:
+                    modified.append(file_name)
+
+                if callback is not None:
+                    callback.progress(_("Verifying"), done, len(suspicious), '%')
+
+    ## Anything in the ports directories that we did not install.
+    extra = []
+    for top_dir in top_dirs:
+        for root, dirs, files in os.walk(base_dir / top_dir):
+            root = Path(root)
+
+            for dir_name in dirs[:]:
+                rel_name = (root / dir_name).relative_to(base_dir).as_posix()
+                if rel_name not in known:
+                    ## No need to list everything inside it too.
+                    extra.append(rel_name + '/')
+                    dirs.remove(dir_name)
+
+            for file_name in files:
+                rel_name = (root / file_name).relative_to(base_dir).as_posix()
+                if rel_name not in known:
+                    extra.append(rel_name)
+
+    return {
+        'missing': sorted(missing),
+        'modified': sorted(modified),
+        'extra': sorted(extra),
+        }
+
+
+__all__ = (
+    'file_crc32',
+    'manifest_from_zip',
+    'manifest_update',
+    'manifest_rewritten',
+    'manifest_modes',
+    'manifest_size',
+    'manifest_load',
+    'manifest_save',
+    'manifest_verify',
+    )
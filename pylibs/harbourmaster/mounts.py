@@ -0,0 +1,215 @@
+
+# System imports
+import os
+import re
+import select
+
+# Included imports
+
+from loguru import logger
+
+# Module imports
+from .config import *
+
+
+################################################################################
+## Mount table
+def _mount_unescape(text):
+    ## The kernel escapes spaces, tabs, newlines and backslashes as octal.
+    return re.sub(r'\\([0-7]{3})', lambda match: chr(int(match.group(1), 8)), text)
+
+
+class MountTable():
+    """
+    Parses /proc/self/mountinfo once, and only reparses it when the kernel says the mounts have changed.
+
+    The kernel flags the file with POLLPRI whenever something is mounted or unmounted, if polling is
+    not available it falls back to checking the mtime.
+    """
+    MOUNTINFO_FILE = '/proc/self/mountinfo'
+
+    def __init__(self, mountinfo_file=None):
+        if mountinfo_file is None:
+            mountinfo_file = self.MOUNTINFO_FILE
+
+        self.mountinfo_file = mountinfo_file
+        self._fd = None
+        self._poll = None
+        self._mtime = None
+        self._mounts = None
+
+    def _read(self):
+        if self._fd is None:
+            self._fd = os.open(self.mountinfo_file, os.O_RDONLY)
+
+            if hasattr(select, 'poll'):
+                self._poll = select.poll()
+                self._poll.register(self._fd, select.POLLPRI | select.POLLERR)
+
+        ## Reading it from the start also clears the POLLPRI event.
+        os.lseek(self._fd, 0, os.SEEK_SET)
+
+        chunks = []
+        while True:
+            data = os.read(self._fd, 65536)
+            if len(data) == 0:
+                break
+
+            chunks.append(data)
+
+        return b''.join(chunks).decode('utf-8', 'replace')
+
+    def _parse(self, text):
+        """
+        Each line looks like this:
+
+            36 35 98:0 /mnt1 /mnt/parent rw,noatime master:1 - ext3 /dev/root rw,errors=continue
+        """
+        mounts = []
+
+        for line in text.split('\n'):
+            sections = line.split()
+            if '-' not in sections:
+                continue
+
+            separator = sections.index('-')
+            if separator < 5 or len(sections) < separator + 3:
+                continue
+
+            mounts.append({
+                'mount_point': _mount_unescape(sections[4]),
+                'fs_type': sections[separator + 1],
+                'source': _mount_unescape(sections[separator + 2]),
+                })
+
+        ## Later mounts hide earlier ones on the same mount point, sort is stable so reverse first.
+        mounts.reverse()
+        mounts.sort(key=lambda mount: len(mount['mount_point']), reverse=True)
+        return mounts
+
+    def changed(self):
+        """
+        Has the mount table changed since it was last loaded.
+        """
+        if self._mounts is None:
+            return True
+
+        if self._poll is not None:
+            return len(self._poll.poll(0)) > 0
+
+        try:
+            return os.stat(self.mountinfo_file).st_mtime_ns != self._mtime
+
+        except OSError:
+            return False
+
+    def refresh(self, force=False):
+        """
+        Reloads the mount table if it has changed, returns False if it is unavailable.
+        """
+        if not force and not self.changed():
+            return True
+
+        try:
+            text = self._read()
+            self._mtime = os.stat(self.mountinfo_file).st_mtime_ns
+
+        except OSError as err:
+            logger.debug(f"Unable to read {self.mountinfo_file}: {err}")
+            self.close()
+            return False
+
+        self._mounts = self._parse(text)
+        return True
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+
+        self._fd = None
+        self._poll = None
+        self._mounts = None
+
+    def mounts(self):
+        if not self.refresh():
+            return []
+
+        return self._mounts
+
+    def find(self, path):
+        """
+        Returns the mount info for the mount that contains path, or None.
+        """
+        if not self.refresh():
+            return None
+
+        real_path = os.path.realpath(str(path))
+
+        for mount in self._mounts:
+            mount_point = mount['mount_point']
+            if real_path == mount_point or real_path.startswith(mount_point.rstrip('/') + '/'):
+                return mount
+
+        return None
+
+    def fs_type(self, path):
+        mount = self.find(path)
+        if mount is None:
+            return None
+
+        return mount['fs_type']
+
+    def free_space(self, path):
+        """
+        Returns the number of bytes available to us on the mount that contains path.
+        """
+        mount = self.find(path)
+        if mount is None:
+            check_path = path
+        else:
+            check_path = mount['mount_point']
+
+        try:
+            stat = os.statvfs(str(check_path))
+
+        except OSError as err:
+            logger.debug(f"Unable to get free space for {path}: {err}")
+            return None
+
+        return stat.f_bavail * stat.f_frsize
+
+    def usage(self):
+        """
+        Returns {mount_point: (fs_type, total_bytes, free_bytes)} for every real mount.
+        """
+        results = {}
+
+        for mount in self.mounts():
+            if mount['mount_point'] in results:
+                continue
+
+            try:
+                stat = os.statvfs(mount['mount_point'])
+
+            except OSError:
+                continue
+
+            if stat.f_blocks == 0:
+                ## proc, sysfs and friends.
+                continue
+
+            results[mount['mount_point']] = (
+                mount['fs_type'],
+                stat.f_blocks * stat.f_frsize,
+                stat.f_bavail * stat.f_frsize)
+
+        return results
+
+
+HM_MOUNTS = MountTable()
+
+
+__all__ = (
+    'MountTable',
+    'HM_MOUNTS',
+    )
@@ -0,0 +1,171 @@
+
+# System imports
+import json
+import os
+
+# Included imports
+
+from loguru import logger
+
+# Module imports
+from .config import *
+from .util import *
+
+
+################################################################################
+## File ownership
+def port_owned_files(port_info):
+    """
+    Returns the set of top level files/dirs a port owns, port.json is not included.
+    """
+    files = port_info.get('files', None) or {}
+
+    return {
+        file_name
+        for item in files
+        if item not in ('port.json', )
+        for file_name in get_dict_list(files, item)}
+
+
+class OwnerIndex():
+    """
+    Keeps a persistent path -> owners index of the top level files/dirs in the ports dir.
+
+    It is updated as ports are installed/uninstalled, and reconciled whenever the ports are loaded,
+    so working out if a file is safe to delete doesn't need to look at every other port.
+    """
+
+    def __init__(self, index_file):
+        self.index_file = index_file
+        self._owners = None
+        self._ports = None
+        self._dirty = False
+
+    def load(self):
+        if self._owners is not None:
+            return
+
+        self._owners = {}
+        self._ports = {}
+
+        if not self.index_file.is_file():
+            return
+
+        try:
+            with open(self.index_file, 'r') as fh:
+                data = json.load(fh)
+
+            for port_name, file_names in data.get('ports', {}).items():
+                self._add(port_name, file_names)
+
+        except (OSError, AttributeError, json.decoder.JSONDecodeError) as err:
+            logger.error(f"Unable to load {self.index_file}: {err}")
+            self._owners = {}
+            self._ports = {}
+            self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+
+        ## Only the port -> files side is stored, the rest is rebuilt on load.
+        data = {
+            'ports': {
+                port_name: sorted(file_names)
+                for port_name, file_names in sorted(self._ports.items())},
+            }
+
+        try:
+            self.index_file.parent.mkdir(parents=True, exist_ok=True)
+            temp_file = self.index_file.with_name(f".{self.index_file.name}.tmp")
+            with open(temp_file, 'w') as fh:
+                json.dump(data, fh, indent=4)
+
+            os.replace(temp_file, self.index_file)
+            self._dirty = False
+
+        except OSError as err:
+            logger.error(f"Unable to save {self.index_file}: {err}")
+
+    def _add(self, port_name, file_names):
+        port_files = self._ports.setdefault(port_name, set())
+
+        for file_name in file_names:
+            if file_name in port_files:
+                continue
+
+            port_files.add(file_name)
+            self._owners.setdefault(file_name, set()).add(port_name)
+
+    def _remove(self, port_name, file_names):
+        port_files = self._ports.get(port_name, None)
+        if port_files is None:
+            return
+
+        for file_name in list(file_names):
+            if file_name not in port_files:
+                continue
+
+            port_files.discard(file_name)
+
+            owners = self._owners.get(file_name, None)
+            if owners is not None:
+                owners.discard(port_name)
+                if len(owners) == 0:
+                    del self._owners[file_name]
+
+        if len(port_files) == 0:
+            del self._ports[port_name]
+
+    def owners(self, file_name):
+        """
+        Returns the set of ports that own file_name.
+        """
+        self.load()
+
+        return self._owners.get(file_name, set())
+
+    def add_port(self, port_name, port_info):
+        """
+        Record all the files a port owns, replacing anything previously recorded for it.
+        """
+        self.load()
+
+        new_files = port_owned_files(port_info)
+        old_files = self._ports.get(port_name, set())
+
+        if new_files == old_files:
+            return
+
+        self._remove(port_name, old_files - new_files)
+        self._add(port_name, new_files - old_files)
+        self._dirty = True
+
+    def remove_port(self, port_name):
+        self.load()
+
+        if port_name not in self._ports:
+            return
+
+        self._remove(port_name, set(self._ports[port_name]))
+        self._dirty = True
+
+    def reconcile(self, all_ports):
+        """
+        Bring the index in line with all_ports, only ports that differ are touched.
+        """
+        self.load()
+
+        for port_name in set(self._ports) - set(all_ports):
+            self.remove_port(port_name)
+
+        for port_name, port_info in all_ports.items():
+            self.add_port(port_name, port_info)
+
+        self.save()
+
+
+__all__ = (
+    'OwnerIndex',
+    'port_owned_files',
+    )
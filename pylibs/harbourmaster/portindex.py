@@ -0,0 +1,343 @@
+
+# System imports
+
+# Included imports
+
+from loguru import logger
+
+# Module imports
+from .config import *
+from .util import *
+
+
+################################################################################
+## Port attribute index
+PORT_RUNTIME_ATTRS = {
+    'frt': 'godot',
+    'mono': 'mono',
+    'jdk11': 'jre',
+    }
+
+
+def port_attrs(port_info):
+    """
+    Returns the list of filter attributes of a port, not including installed/broken.
+    """
+    attrs = []
+    seen = set()
+
+    def add_attr(attr):
+        if attr not in seen:
+            seen.add(attr)
+            attrs.append(attr)
+
+    runtime = port_info.get('attr', {}).get('runtime', None)
+    if runtime is not None:
+        for runtime_key, runtime_attr in PORT_RUNTIME_ATTRS.items():
+            if runtime_key in runtime:
+                add_attr(runtime_attr)
+
+    for genre in port_info.get('attr', {}).get('genres', []):
+        add_attr(genre.casefold())
+
+    for porter in port_info.get('attr', {}).get('porter', []):
+        add_attr(porter.casefold())
+
+    rtr = port_info.get('attr', {}).get('rtr', False)
+    if rtr:
+        add_attr('rtr')
+
+    return attrs
+
+
+class PortTable():
+    """
+    The ports from one place (a source, or the installed ports), with an attribute -> names index.
+    """
+    def __init__(self):
+        self.ports = {}
+        self.order = {}
+        self.keys = {}
+        self.attrs = {}
+        self.passes = set()
+
+    def add(self, port_name, port_info, passes=True):
+        if port_name in self.ports:
+            self.remove(port_name)
+
+        self.ports[port_name] = port_info
+        self.order[port_name] = len(self.order)
+
+        ## Collation key, list_ports sorts by this.
+        self.keys[port_name] = port_info.get('attr', {}).get('title', port_name).casefold()
+
+        for attr in port_attrs(port_info):
+            self.attrs.setdefault(attr, set()).add(port_name)
+
+        if passes:
+            self.passes.add(port_name)
+
+    def remove(self, port_name):
+        port_info = self.ports.pop(port_name, None)
+        if port_info is None:
+            return
+
+        del self.order[port_name]
+        del self.keys[port_name]
+        self.passes.discard(port_name)
+
+        for attr in port_attrs(port_info):
+            names = self.attrs.get(attr, None)
+            if names is None:
+                continue
+
+            names.discard(port_name)
+            if len(names) == 0:
+                del self.attrs[attr]
+
+    def attr_set(self, port_filter, installed, broken):
+        port_filter = port_filter.casefold()
+
+        if port_filter == 'installed':
+            return installed
+
+        if port_filter == 'broken':
+            return broken
+
+        return self.attrs.get(port_filter, set())
+
+    def match_set(self, filters, installed, broken):
+        """
+        Returns the set of names of the ports that have every attribute in filters.
+        """
+        result = None
+
+        ## Smallest sets first keeps the intersections cheap.
+        attr_sets = [
+            self.attr_set(port_filter, installed, broken)
+            for port_filter in filters]
+
+        for attr_set in sorted(attr_sets, key=len):
+            if result is None:
+                result = self.passes & attr_set
+            else:
+                result &= attr_set
+
+            if len(result) == 0:
+                return set()
+
+        if result is None:
+            return set(self.passes)
+
+        ## installed/broken can contain ports we don't have.
+        return result & self.ports.keys()
+
+
+class PortIndex():
+    """
+    Inverted attribute index over all the ports harbourmaster knows about, this is what list_ports uses.
+
+    The source half is rebuilt lazily after a source has been loaded or updated, the installed half is
+    rebuilt after load_ports and then kept up to date as ports are installed and uninstalled.
+
+    Every change bumps version, so results can be cached against it.
+    """
+    def __init__(self, hm):
+        self.hm = hm
+        self.version = 0
+        self._sources = None
+        self._installed = None
+        self._sorted = None
+
+    def _changed(self):
+        self.version += 1
+        self._sorted = None
+
+    def sources_changed(self):
+        self._sources = None
+        self._changed()
+
+    def installed_changed(self):
+        self._installed = None
+        self._changed()
+
+    def _build_sources(self):
+        capabilities = capabilities_mask(tuple(self.hm.device['capabilities']))
+
+        self._sources = []
+        for source_prefix, source in self.hm.sources.items():
+            table = PortTable()
+
+            for port_name in source.ports:
+                port_info = source.port_info(port_name)
+                requirements = port_info.get('attr', {}).get('reqs', [])
+
+                table.add(port_name.casefold(), port_info, match_requirements(capabilities, requirements))
+
+            self._sources.append(table)
+
+        logger.debug(f"PortIndex: indexed {sum(len(table.ports) for table in self._sources)} source ports.")
+
+    def _build_installed(self):
+        self._installed = PortTable()
+
+        for ports in (self.hm.installed_ports, self.hm.broken_ports):
+            for port_name, port_info in ports.items():
+                if port_name.casefold() in self._installed.ports:
+                    continue
+
+                self._installed.add(port_name.casefold(), port_info)
+
+    def port_installed(self, port_name, port_info):
+        if self._installed is not None:
+            self._installed.add(port_name.casefold(), port_info)
+
+        self._changed()
+
+    def port_uninstalled(self, port_name):
+        if self._installed is not None:
+            self._installed.remove(port_name.casefold())
+
+        self._changed()
+
+    def _tables(self):
+        if self._sources is None:
+            self._build_sources()
+
+        if self._installed is None:
+            self._build_installed()
+
+        return [self._installed] + self._sources
+
+    def _build_sorted(self):
+        """
+        Every (table, port_name) in title order, ties keep the order list_ports would find them in.
+        """
+        entries = []
+        for table_number, table in enumerate(self._tables()):
+            for port_name, port_key in table.keys.items():
+                entries.append((port_key, table_number, table.order[port_name], table, port_name))
+
+        entries.sort(key=lambda entry: entry[:3])
+
+        self._sorted = [
+            (entry[3], entry[4])
+            for entry in entries]
+
+    def query(self, filters):
+        """
+        Returns {port_name: port_info} for all ports matching filters, unsorted.
+        """
+        return {
+            port_name: table.ports[port_name]
+            for port_name, table in self._query(filters).items()}
+
+    def query_sorted(self, filters):
+        """
+        Same as query, but sorted by title.
+
+        Instead of sorting the results they are picked out of the presorted list of all ports.
+        """
+        return dict(self.iter_sorted(filters))
+
+    def iter_sorted(self, filters):
+        """
+        Yields (port_name, port_info) in the same order as query_sorted, without building the whole result.
+        """
+        results = self._query(filters)
+
+        if self._sorted is None:
+            self._build_sorted()
+
+        for table, port_name in self._sorted:
+            if results.get(port_name, None) is table:
+                yield port_name, table.ports[port_name]
+
+    def _query(self, filters):
+        """
+        Returns {port_name: table} for all ports matching filters.
+        """
+        self._tables()
+
+        filters = list(filters)
+        not_installed = 'not installed' in filters
+        if not_installed:
+            filters.remove('not installed')
+
+        broken = self.hm.broken_ports.keys()
+        installed = self.hm.installed_ports.keys() | broken
+
+        results = {}
+
+        if 'installed' in filters:
+            for port_name in self._installed.match_set(filters, installed, broken):
+                results[port_name] = self._installed
+
+        ## The first source to have a port wins.
+        for table in self._sources:
+            for port_name in table.match_set(filters, installed, broken):
+                if not_installed and port_name in installed:
+                    continue
+
+                if port_name in results:
+                    continue
+
+                results[port_name] = table
+
+        return results
+
+    def facets(self, filters, candidates):
+        """
+        Returns {candidate: len(query(filters + [candidate]))} for every candidate, in one pass.
+
+        Each table is matched against filters once, then every candidate is just one more intersection.
+        """
+        self._tables()
+
+        all_filters = list(filters)
+        filters = list(filters)
+        not_installed = 'not installed' in filters
+        if not_installed:
+            filters.remove('not installed')
+
+        broken = self.hm.broken_ports.keys()
+        installed = self.hm.installed_ports.keys() | broken
+
+        if 'installed' in filters:
+            installed_matches = self._installed.match_set(filters, installed, broken)
+        else:
+            installed_matches = None
+
+        source_matches = [
+            (table, table.match_set(filters, installed, broken))
+            for table in self._sources]
+
+        results = {}
+        for candidate in candidates:
+            if candidate in ('installed', 'not installed'):
+                ## These change which ports are looked at, not just which ones match.
+                results[candidate] = len(self.query(all_filters + [candidate]))
+                continue
+
+            names = set()
+
+            if installed_matches is not None:
+                names |= installed_matches & self._installed.attr_set(candidate, installed, broken)
+
+            for table, matches in source_matches:
+                table_names = matches & table.attr_set(candidate, installed, broken)
+
+                if not_installed:
+                    table_names -= installed
+
+                names |= table_names
+
+            results[candidate] = len(names)
+
+        return results
+
+
+__all__ = (
+    'PortIndex',
+    'port_attrs',
+    )
@@ -0,0 +1,297 @@
+
+# System imports
+import bisect
+import json
+import os
+import re
+
+# Included imports
+
+from loguru import logger
+
+# Module imports
+from .config import *
+from .util import *
+
+
+################################################################################
+## Port search
+SEARCH_INDEX_VERSION = 1
+
+## How much a match in each field is worth.
+SEARCH_FIELD_WEIGHTS = {
+    'title': 8,
+    'porter': 4,
+    'genres': 2,
+    'desc': 1,
+    }
+
+SEARCH_WORD_RE = re.compile(r'\w+')
+
+
+def search_words(text):
+    return SEARCH_WORD_RE.findall(text.casefold())
+
+
+def search_trigrams(word):
+    return {
+        word[i:i + 3]
+        for i in range(len(word) - 2)}
+
+
+class SearchIndex():
+    """
+    Word index over the title, porters, genres and description of a set of ports.
+
+    words maps each word to {port_name: weight}, words of 3 letters or more can be found by any
+    substring through the trigram index, shorter queries only match word prefixes.
+    """
+    def __init__(self, words, titles, trigrams=None, revision=None):
+        self.words = words
+        self.titles = titles
+        self.revision = revision
+
+        ## words is kept sorted, so prefix lookups are just a bisect.
+        self.sorted_words = list(words)
+
+        if trigrams is None:
+            trigrams = {}
+            for word in self.sorted_words:
+                for trigram in search_trigrams(word):
+                    trigrams.setdefault(trigram, []).append(word)
+
+        self.trigrams = {
+            trigram: frozenset(trigram_words)
+            for trigram, trigram_words in trigrams.items()}
+
+    @classmethod
+    def build(cls, ports, revision=None):
+        """
+        Builds the index from an iterable of (port_name, port_info).
+        """
+        words = {}
+        titles = {}
+
+        for port_name, port_info in ports:
+            attr = port_info.get('attr', {})
+            title = attr.get('title', None) or port_name.rsplit('.', 1)[0]
+            titles[port_name] = title.casefold()
+
+            fields = {
+                'title': [title],
+                'porter': attr.get('porter', None) or [],
+                'genres': attr.get('genres', None) or [],
+                'desc': [attr.get('desc', None) or ""],
+                }
+
+            for field, texts in fields.items():
+                if isinstance(texts, str):
+                    texts = [texts]
+
+                weight = SEARCH_FIELD_WEIGHTS[field]
+                for text in texts:
+                    for word in set(search_words(text)):
+                        word_ports = words.setdefault(word, {})
+                        word_ports[port_name] = word_ports.get(port_name, 0) + weight
+
+        words = {
+            word: words[word]
+            for word in sorted(words)}
+
+        return cls(words, titles, revision=revision)
+
+    @classmethod
+    def load(cls, index_file, revision):
+        """
+        Loads a saved index, returns None if it is missing or out of date.
+        """
+        if not index_file.is_file():
+            return None
+
+        try:
+            with open(index_file, 'r') as fh:
+                data = json.load(fh)
+
+        except (OSError, json.decoder.JSONDecodeError) as err:
+            logger.error(f"Unable to load {index_file}: {err}")
+            return None
+
+        if data.get('version', None) != SEARCH_INDEX_VERSION or data.get('revision', None) != revision:
+            return None
+
+        return cls(data['words'], data['titles'], data['trigrams'], revision)
+
+    def save(self, index_file):
+        data = {
+            'version': SEARCH_INDEX_VERSION,
+            'revision': self.revision,
+            'titles': self.titles,
+            'words': self.words,
+            'trigrams': {
+                trigram: sorted(trigram_words)
+                for trigram, trigram_words in self.trigrams.items()},
+            }
+
+        try:
+            temp_file = index_file.with_name(f".{index_file.name}.tmp")
+            with open(temp_file, 'w') as fh:
+                json.dump(data, fh, separators=(',', ':'))
+
+            os.replace(temp_file, index_file)
+
+        except OSError as err:
+            logger.error(f"Unable to save {index_file}: {err}")
+
+    def match_word(self, token, within=None):
+        """
+        Returns {word: factor} for every word token matches, exact matches score highest.
+
+        within can be the matches of a shorter token that this one extends, then only those are checked.
+        """
+        if within is not None:
+            candidates = within
+
+        elif len(token) >= 3:
+            trigram_sets = sorted(
+                (self.trigrams.get(trigram, frozenset()) for trigram in search_trigrams(token)),
+                key=len)
+
+            candidates = set(trigram_sets[0])
+            for trigram_set in trigram_sets[1:]:
+                candidates &= trigram_set
+
+        else:
+            candidates = []
+            start = bisect.bisect_left(self.sorted_words, token)
+            for word in self.sorted_words[start:]:
+                if not word.startswith(token):
+                    break
+
+                candidates.append(word)
+
+        matches = {}
+        for word in candidates:
+            if word == token:
+                matches[word] = 3
+
+            elif word.startswith(token):
+                matches[word] = 2
+
+            elif len(token) >= 3 and token in word:
+                matches[word] = 1
+
+        return matches
+
+    def token_scores(self, matches):
+        """
+        Returns {port_name: score} for the word matches of one token, the best matching word counts.
+        """
+        scores = {}
+        for word, factor in matches.items():
+            for port_name, weight in self.words[word].items():
+                if scores.get(port_name, 0) < factor * weight:
+                    scores[port_name] = factor * weight
+
+        return scores
+
+    @staticmethod
+    def combine(token_scores):
+        """
+        Combines the scores of each token, a port has to match every token.
+        """
+        token_scores = sorted(token_scores, key=len)
+        if len(token_scores) == 0:
+            return {}
+
+        scores = token_scores[0]
+        for other_scores in token_scores[1:]:
+            scores = {
+                port_name: score + other_scores[port_name]
+                for port_name, score in scores.items()
+                if port_name in other_scores}
+
+        return scores
+
+
+class SearchQuery():
+    """
+    An incremental search, call update() with the full text on every keystroke.
+
+    The word matches for each token are kept, so when a token grows by a letter only the words
+    that matched it before need to be checked.
+    """
+    def __init__(self, hm, filters=None):
+        self.hm = hm
+        self.filters = list(filters or [])
+        self._cache = {}
+
+    def _token_scores(self, index, cache, token):
+        """
+        Returns the {port_name: score} for a token, cache keeps (matches, scores) for each token.
+        """
+        if token in cache:
+            return cache[token][1]
+
+        within = None
+        for old_token, (old_matches, old_scores) in cache.items():
+            ## Substring matches only narrow if the old token was long enough to use them.
+            if token.startswith(old_token) and (len(old_token) >= 3 or len(token) < 3):
+                if within is None or len(old_matches) < len(within):
+                    within = old_matches
+
+        matches = index.match_word(token, within)
+        cache[token] = (matches, index.token_scores(matches))
+        return cache[token][1]
+
+    def update(self, text, limit=None):
+        """
+        Returns the port names matching text, best first.
+        """
+        tokens = search_words(text)
+        if len(tokens) == 0:
+            return []
+
+        allowed = self.hm.list_ports(self.filters)
+
+        new_cache = {}
+        results = []
+        seen = set()
+
+        for index in self.hm.search_indexes():
+            cache = self._cache.get(id(index), {})
+
+            scores = index.combine([
+                self._token_scores(index, cache, token)
+                for token in tokens])
+
+            ## Only keep what the next keystroke could use.
+            new_cache[id(index)] = {
+                token: cache[token]
+                for token in tokens}
+
+            for port_name, score in scores.items():
+                ## First source to have a port wins, same as list_ports.
+                if port_name not in allowed or port_name in seen:
+                    continue
+
+                results.append((-score, index.titles[port_name], port_name))
+
+            seen.update(index.titles)
+
+        self._cache = new_cache
+
+        results.sort()
+
+        if limit is not None:
+            results = results[:limit]
+
+        return [
+            port_name
+            for score, title, port_name in results]
+
+
+__all__ = (
+    'SearchIndex',
+    'SearchQuery',
+    'search_words',
+    )
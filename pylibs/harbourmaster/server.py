@@ -0,0 +1,364 @@
+
+# System imports
+import contextlib
+import io
+import json
+import os
+import queue
+import socket
+import stat
+import threading
+import time
+
+from pathlib import Path
+
+# Included imports
+import utility
+
+from loguru import logger
+
+# Module imports
+from .config import *
+from .util import *
+
+
+################################################################################
+## JSON-RPC server
+##
+## One json object per line each way, the params of a command are its command line arguments:
+##
+##   {"jsonrpc": "2.0", "id": 1, "method": "list", "params": ["rtr"]}
+##
+## Commands are run one at a time on the serving thread, HarbourMaster and cprint are not thread safe,
+## but any number of clients can be connected and queue up requests, or cancel them.
+
+RPC_PARSE_ERROR      = -32700
+RPC_INVALID_REQUEST  = -32600
+RPC_METHOD_NOT_FOUND = -32601
+RPC_INVALID_PARAMS   = -32602
+RPC_INTERNAL_ERROR   = -32603
+RPC_CANCELLED        = -32800
+
+## Downloads report progress for every chunk, clients only need to hear about it this often.
+RPC_PROGRESS_INTERVAL = 0.1
+
+RPC_RECV_SIZE = 64 * 1024
+
+
+def rpc_error(request_id, code, message):
+    return {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': code, 'message': message}}
+
+
+def rpc_result(request_id, result):
+    return {'jsonrpc': '2.0', 'id': request_id, 'result': result}
+
+
+class RpcJob():
+    def __init__(self, client, request_id, method, params):
+        self.client = client
+        self.request_id = request_id
+        self.method = method
+        self.params = params
+        self.cancelled = False
+
+    def notify(self, method, params):
+        params['id'] = self.request_id
+        self.client.send({'jsonrpc': '2.0', 'method': method, 'params': params})
+
+    def reply(self, data):
+        if self.request_id is not None:
+            self.client.jobs.pop(self.request_id, None)
+            self.client.send(data)
+
+
+class RpcCallback(Callback):
+    """
+    Turns progress and messages into notifications for the client running the command.
+
+    Cancelling works the same way as in pugwash, once the job is cancelled the next progress() raises
+    a CancelEvent, but only while cancellable is True.
+    """
+    def __init__(self, job, config):
+        super().__init__()
+        self.job = job
+        self.config = config
+        self.cancellable = True
+        self.last_progress = 0
+
+    def progress(self, message, amount, total=None, fmt=None):
+        self.do_cancel()
+
+        if message is None:
+            return
+
+        now = time.monotonic()
+        if (now - self.last_progress) < RPC_PROGRESS_INTERVAL and amount != total:
+            return
+
+        self.last_progress = now
+        self.job.notify('progress', {'message': message, 'amount': amount, 'total': total, 'fmt': fmt})
+
+    def message(self, message):
+        self.job.notify('message', {'message': message})
+
+    def message_box(self, message):
+        self.job.notify('message_box', {'message': message})
+
+    def do_cancel(self):
+        if self.cancellable is True and self.job.cancelled:
+            raise CancelEvent()
+
+    @contextlib.contextmanager
+    def enable_cancellable(self, cancellable=False):
+        old_cancellable = self.cancellable
+        self.cancellable = cancellable
+        self.was_cancelled = False
+
+        try:
+            yield
+
+        except CancelEvent:
+            self.was_cancelled = True
+
+        finally:
+            self.cancellable = old_cancellable
+
+
+class RpcClient():
+    def __init__(self, server, sock):
+        self.server = server
+        self.sock = sock
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.closed = False
+
+    def send(self, data):
+        line = (json.dumps(data) + '\n').encode('utf-8')
+
+        with self.lock:
+            if self.closed:
+                return
+
+            try:
+                self.sock.sendall(line)
+
+            except OSError as err:
+                logger.debug(f"serve: client went away: {err}")
+                self.closed = True
+
+    def run(self):
+        buffer = bytearray()
+
+        try:
+            while not self.closed:
+                data = self.sock.recv(RPC_RECV_SIZE)
+                if len(data) == 0:
+                    break
+
+                buffer += data
+                while True:
+                    end = buffer.find(b'\n')
+                    if end == -1:
+                        break
+
+                    line = bytes(buffer[:end]).strip()
+                    del buffer[:end + 1]
+
+                    if line:
+                        self.server.handle_line(self, line)
+
+        except OSError as err:
+            logger.debug(f"serve: client read failed: {err}")
+
+        finally:
+            with self.lock:
+                self.closed = True
+
+            ## Nobody is left to hear about them.
+            for job in list(self.jobs.values()):
+                job.cancelled = True
+
+            self.sock.close()
+
+
+class HarbourServer():
+    """
+    Serves commands to clients connected to a unix socket, keeping the one HarbourMaster loaded.
+
+    commands is a {method: function(hm, argv)} dict, the same as the command line uses. Output
+    printed with cprint is returned as the result along with the return code.
+
+    Anyone who can connect can install and uninstall ports, so by default only the owner and group
+    get to, see mode.
+    """
+    def __init__(self, hm, socket_path, commands, mode=0o660):
+        self.hm = hm
+        self.socket_path = Path(socket_path)
+        self.commands = commands
+        self.mode = mode
+        self.jobs = queue.Queue()
+        self.sock = None
+
+    def handle_line(self, client, line):
+        try:
+            request = json.loads(line)
+
+        except ValueError as err:
+            client.send(rpc_error(None, RPC_PARSE_ERROR, f"Parse error: {err}"))
+            return
+
+        if not isinstance(request, dict):
+            client.send(rpc_error(None, RPC_INVALID_REQUEST, "Invalid Request"))
+            return
+
+        request_id = request.get('id', None)
+        method = request.get('method', None)
+        params = request.get('params', [])
+
+        if not isinstance(request_id, (str, int, float, type(None))):
+            client.send(rpc_error(None, RPC_INVALID_REQUEST, "Invalid Request"))
+            return
+
+        if request.get('jsonrpc', None) != '2.0' or not isinstance(method, str):
+            client.send(rpc_error(request_id, RPC_INVALID_REQUEST, "Invalid Request"))
+            return
+
+        if method == 'cancel':
+            if isinstance(params, dict):
+                target = params.get('id', None)
+            elif isinstance(params, list) and len(params) > 0:
+                target = params[0]
+            else:
+                target = None
+
+            job = client.jobs.get(target, None)
+            if job is not None:
+                logger.info(f"serve: cancelling {job.method} [{target}]")
+                job.cancelled = True
+
+            if request_id is not None:
+                client.send(rpc_result(request_id, job is not None))
+
+            return
+
+        if method == 'commands':
+            if request_id is not None:
+                client.send(rpc_result(request_id, sorted(self.commands)))
+
+            return
+
+        if method == 'shutdown':
+            if request_id is not None:
+                client.send(rpc_result(request_id, True))
+
+            self.jobs.put(None)
+            return
+
+        if method.casefold() not in self.commands:
+            client.send(rpc_error(request_id, RPC_METHOD_NOT_FOUND, f"Method not found: {method}"))
+            return
+
+        if not isinstance(params, list) or not all(isinstance(param, str) for param in params):
+            client.send(rpc_error(request_id, RPC_INVALID_PARAMS, "Invalid params, expected a list of strings"))
+            return
+
+        if request_id is not None and request_id in client.jobs:
+            client.send(rpc_error(request_id, RPC_INVALID_REQUEST, f"Request {request_id} is already running"))
+            return
+
+        job = RpcJob(client, request_id, method.casefold(), params)
+        if request_id is not None:
+            client.jobs[request_id] = job
+
+        self.jobs.put(job)
+
+    def run_job(self, job):
+        if job.cancelled:
+            job.reply(rpc_error(job.request_id, RPC_CANCELLED, "Request cancelled"))
+            return
+
+        logger.info(f"serve: {job.method} {job.params}")
+
+        output = io.StringIO()
+        old_callback = self.hm.callback
+        callback = self.hm.callback = RpcCallback(job, getattr(old_callback, 'config', {}))
+        utility.do_cprint_output(output)
+        cancelled = False
+
+        try:
+            result = self.commands[job.method](self.hm, job.params)
+            cancelled = callback.was_cancelled
+
+        except CancelEvent:
+            cancelled = True
+
+        except Exception as err:
+            logger.exception(f"serve: {job.method} failed")
+            job.reply(rpc_error(job.request_id, RPC_INTERNAL_ERROR, f"{type(err).__name__}: {err}"))
+            return
+
+        finally:
+            utility.do_cprint_output(None)
+            self.hm.callback = old_callback
+
+        ## A cancel that came in during a part that could not be cancelled lets the command finish.
+        if cancelled:
+            job.reply(rpc_error(job.request_id, RPC_CANCELLED, "Request cancelled"))
+            return
+
+        job.reply(rpc_result(job.request_id, {'code': result or 0, 'output': output.getvalue()}))
+
+    def accept_loop(self):
+        while True:
+            try:
+                client_sock, _ = self.sock.accept()
+
+            except OSError:
+                ## The socket was closed.
+                break
+
+            client = RpcClient(self, client_sock)
+            threading.Thread(target=client.run, daemon=True).start()
+
+    def _is_socket(self):
+        try:
+            return stat.S_ISSOCK(os.lstat(self.socket_path).st_mode)
+
+        except FileNotFoundError:
+            return False
+
+    def serve(self):
+        ## Only ever replace an old socket, a typo in the path should not delete a file.
+        if self._is_socket():
+            self.socket_path.unlink()
+
+        elif self.socket_path.exists() or self.socket_path.is_symlink():
+            logger.error(f"Unable to serve on {self.socket_path}, it already exists and is not a socket.")
+            raise HarbourException(f"{self.socket_path} already exists")
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        try:
+            self.sock.bind(str(self.socket_path))
+            os.chmod(self.socket_path, self.mode)
+            self.sock.listen()
+
+            threading.Thread(target=self.accept_loop, daemon=True).start()
+
+            while True:
+                job = self.jobs.get()
+                if job is None:
+                    break
+
+                self.run_job(job)
+
+        finally:
+            self.sock.close()
+
+            if self._is_socket():
+                self.socket_path.unlink()
+
+
+__all__ = (
+    'HarbourServer',
+    )
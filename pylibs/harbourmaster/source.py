@@ -16,6 +16,7 @@ from utility import cprint, cstrip
 
 # Module imports
 from .config import *
+from .extract import *
 from .info import *
 from .util import *
 
@@ -87,9 +88,11 @@ class GitHubRawReleaseV1(BaseSource):
         self._load()
         self._load_images()
 
+        self.hm.source_changed(self._prefix)
+
     def save(self):
         with self._file_name.open('w') as fh:
-            json.dump(self._config, fh, indent=4)
+            json.dump(self._config, fh, indent=4, default=port_info_json)
 
     def clean_name(self, text):
         return name_cleaner(text)
@@ -149,6 +152,9 @@ class GitHubRawReleaseV1(BaseSource):
         self.utils = []
         self.images = {}
 
+        ## Anything looked up while updating will see an empty source, it is marked changed again once done.
+        self.hm.source_changed(self._prefix)
+
         if self._did_update:
             # cprint(f"- <b>{self._config['name']}</b>: up to date already.")
             self.hm.callback.message("  - {}".format(_("Up to date already")))
@@ -199,17 +205,21 @@ class GitHubRawReleaseV1(BaseSource):
         self._config['last_checked'] = datetime.datetime.now().isoformat()
 
         self.save()
+        self.hm.source_changed(self._prefix)
         self._did_update = True
         # cprint(f"- <b>{self._config['name']}:</b> Done.")
         self.hm.callback.message("  - {}".format(_("Done.")))
 
-    def download(self, port_name, temp_dir=None, md5_result=None):
+    def download(self, port_name, temp_dir=None, md5_result=None, callback=None):
         if md5_result is None:
             md5_result = [None]
 
+        if callback is None:
+            callback = self.hm.callback
+
         if port_name not in self._data:
             logger.error(f"Unable to find port {port_name}")
-            self.hm.callback.message_box(_("Unable to find {port_name}.").format(port_name=port_name))
+            callback.message_box(_("Unable to find {port_name}.").format(port_name=port_name))
             return None
 
         if temp_dir is None:
@@ -220,24 +230,24 @@ class GitHubRawReleaseV1(BaseSource):
         elif (port_name + '.md5sum') in self._data:
             md5_file = port_name + '.md5sum'
         else:
-            self.hm.callback.message_box(_("Unable to find verification info for {port_name}.").format(port_name=port_name))
+            callback.message_box(_("Unable to find verification info for {port_name}.").format(port_name=port_name))
             logger.error(f"Unable to find md5 for {port_name}")
             return None
 
         md5_source = fetch_text(self._data[md5_file]['url'])
         if md5_source is None:
             logger.error(f"Unable to download md5 file: {self._data[md5_file]['url']!r}")
-            self.hm.callback.message_box(_("Unable to download verification info for {port_name}.").format(port_name=port_name))
+            callback.message_box(_("Unable to download verification info for {port_name}.").format(port_name=port_name))
             return None
 
         md5_source = md5_source.strip().split(' ', 1)[0]
 
-        zip_file = download(temp_dir / port_name, self._data[port_name]['url'], md5_source, callback=self.hm.callback)
+        zip_file = download(temp_dir / port_name, self._data[port_name]['url'], md5_source, callback=callback)
 
         if zip_file is not None:
             # cprint("<b,g,>Success!</b,g,>")
 
-            self.hm.callback.message("  - {}".format(_("Success!")))
+            callback.message("  - {}".format(_("Success!")))
 
         md5_result[0] = md5_source
 
@@ -284,7 +294,9 @@ class PortMasterV1(GitHubRawReleaseV1):
     VERSION = 4
 
     def _load(self):
-        self._info = self._config.setdefault('data', {}).setdefault('info', {})
+        ## Held as PortRecords, they take a lot less memory than the dicts json gives us.
+        data = self._config.setdefault('data', {})
+        self._info = data['info'] = port_records(data.get('info', {}))
 
     def _clear(self):
         self._info = {}
@@ -303,7 +315,7 @@ class PortMasterV1(GitHubRawReleaseV1):
 
             port_info = self._portsmd_to_portinfo(line)
 
-            self._info[port_info['name']] = port_info
+            self._info[port_info['name']] = PortRecord(port_info)
 
             self.ports.append(port_info['name'])
 
@@ -331,6 +343,7 @@ class PortMasterV1(GitHubRawReleaseV1):
                 for file_name in self._images_dir.iterdir()
                 if file_name.suffix in ('.png', '.jpg')]
 
+            buffer = bytearray(HM_EXTRACT_BUFFER_SIZE)
             with zipfile.ZipFile(images_zip, 'r') as zf:
                 for zip_name in zf.namelist():
                     if zip_name.casefold().rsplit('.')[-1] not in ('jpg', 'png'):
@@ -340,8 +353,7 @@ class PortMasterV1(GitHubRawReleaseV1):
                     if file_name not in images_to_delete:
                         logger.debug(f"adding {file_name}")
 
-                    with open(file_name, 'wb') as fh:
-                        fh.write(zf.read(zip_name))
+                    zip_copy(zf, zip_name, file_name, buffer)
 
                     if file_name in images_to_delete:
                         images_to_delete.remove(file_name)
@@ -416,9 +428,9 @@ class PortMasterV1(GitHubRawReleaseV1):
 
         return port_info
 
-    def download(self, port_name, temp_dir=None):
+    def download(self, port_name, temp_dir=None, callback=None):
         md5_result = [None]
-        zip_file = super().download(port_name, temp_dir, md5_result)
+        zip_file = super().download(port_name, temp_dir, md5_result, callback=callback)
 
         if zip_file is None:
             return None
@@ -450,7 +462,8 @@ class GitHubRepoV1(GitHubRawReleaseV1):
         """
         Overload to add additional loading.
         """
-        self._info = self._config.setdefault('data', {}).setdefault('info', {})
+        data = self._config.setdefault('data', {})
+        self._info = data['info'] = port_records(data.get('info', {}))
 
     def update(self):
         # cprint(f"<b>{self._config['name']}</b>: updating")
@@ -464,6 +477,8 @@ class GitHubRepoV1(GitHubRawReleaseV1):
         self.ports = []
         self.utils = []
 
+        self.hm.source_changed(self._prefix)
+
         user_name = self._config['config']['user_name']
         repo_name = self._config['config']['repo_name']
         branch_name = self._config['config']['branch_name']
@@ -520,7 +535,7 @@ class GitHubRepoV1(GitHubRawReleaseV1):
                 port_name = self.clean_name(port_name)
 
                 # Clean it up.
-                self._info[port_name] = port_info_load(port_info)
+                self._info[port_name] = PortRecord(port_info_load(port_info))
 
                 self.ports.append(port_name)
 
@@ -534,14 +549,15 @@ class GitHubRepoV1(GitHubRawReleaseV1):
         self._config['last_checked'] = datetime.datetime.now().isoformat()
 
         self.save()
+        self.hm.source_changed(self._prefix)
         self._did_update = True
         # cprint(f"- <b>{self._config['name']}:</b> Done.")
         self.hm.callback.message(f"  - Done.")
 
 
-    def download(self, port_name, temp_dir=None):
+    def download(self, port_name, temp_dir=None, callback=None):
         md5_result = [None]
-        zip_file = super().download(port_name, temp_dir, md5_result)
+        zip_file = super().download(port_name, temp_dir, md5_result, callback=callback)
 
         if zip_file is None:
             return None
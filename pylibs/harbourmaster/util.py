@@ -10,6 +10,7 @@ import re
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 
 from gettext import gettext as _
@@ -24,6 +25,7 @@ from loguru import logger
 from utility import cprint, cstrip
 
 from .config import *
+from .mounts import *
 
 
 ################################################################################
@@ -262,7 +264,12 @@ def hash_file(file_name):
 
     md5 = hashlib.md5()
     with file_name.open('rb') as fh:
-        md5.update(fh.read())
+        while True:
+            data = fh.read(HM_EXTRACT_BUFFER_SIZE)
+            if len(data) == 0:
+                break
+
+            md5.update(data)
 
     return md5.hexdigest()
 
@@ -433,6 +440,26 @@ def remove_dict_list(base_dict, key, value):
         elif len(result) == 1:
             base_dict[key] = result[0]
 
+
+def _get_path_fs_df(path):
+    try:
+        lines = subprocess.check_output(['df', '-PT', str(path)]).decode().split('\n')
+    except subprocess.CalledProcessError as err:
+        return None
+
+    if len(lines) < 2:
+        return None
+
+    if lines[1].strip() == '':
+        return None
+
+    sections = re.split(r'\s+', lines[1])
+    if len(sections) < 2:
+        return None
+
+    return sections[1]
+
+
 def get_path_fs(path):
     """
     Get the fs type of the specified path.
@@ -450,22 +477,17 @@ def get_path_fs(path):
     else:
         return None
 
-    try:
-        lines = subprocess.check_output(['df', '-PT', str(path)]).decode().split('\n')
-    except subprocess.CalledProcessError as err:
-        return None
+    if not HM_MOUNTS.refresh():
+        return _get_path_fs_df(path)
 
-    if len(lines) < 2:
-        return None
+    return HM_MOUNTS.fs_type(path)
 
-    if lines[1].strip() == '':
-        return None
-
-    sections = re.split(r'\s+', lines[1])
-    if len(sections) < 2:
-        return None
 
-    return sections[1]
+def get_path_free(path):
+    """
+    Get the free space in bytes of the mount that contains the specified path.
+    """
+    return HM_MOUNTS.free_space(path)
 
 
 def timeit(func):
@@ -493,14 +515,44 @@ def make_temp_directory():
         shutil.rmtree(temp_dir)
 
 
-def match_requirements(capabilities, requirements):
+## Every capability name seen gets its own bit, so a set of capabilities is just an int.
+REQUIREMENT_BITS = {}
+REQUIREMENT_LOCK = threading.Lock()
+
+
+def requirement_bit(name):
+    bit = REQUIREMENT_BITS.get(name, None)
+    if bit is None:
+        with REQUIREMENT_LOCK:
+            bit = REQUIREMENT_BITS.setdefault(name, 1 << len(REQUIREMENT_BITS))
+
+    return bit
+
+
+@functools.lru_cache(maxsize=64)
+def capabilities_mask(capabilities):
     """
-    Matches hardware capabilities to port requirements.
+    Returns the capability bits for a tuple of capabilities.
     """
-    if len(requirements) == 0:
-        return True
+    mask = 0
+    for capability in capabilities:
+        mask |= requirement_bit(capability)
+
+    return mask
+
+
+@functools.lru_cache(maxsize=2048)
+def compile_requirements(requirements):
+    """
+    Compiles a tuple of requirements into (all_mask, none_mask, any_masks).
+
+    A set of capabilities passes if it has every bit in all_mask, no bits in none_mask, and at least
+    one bit from each of any_masks.
+    """
+    all_mask = 0
+    none_mask = 0
+    any_masks = []
 
-    passed = True
     for requirement in requirements:
         match_not = True
 
@@ -508,21 +560,44 @@ def match_requirements(capabilities, requirements):
             match_not = False
             requirement = requirement[1:]
 
-        if '|' in requirement:
-            passed = any(
-                req in capabilities
-                for req in requirement.split('|')) == match_not
+        mask = 0
+        for req in requirement.split('|'):
+            mask |= requirement_bit(req)
+
+        if not match_not:
+            none_mask |= mask
+
+        elif '|' in requirement:
+            any_masks.append(mask)
 
         else:
-            if requirement in capabilities:
-                passed = match_not
-            else:
-                passed = not match_not
+            all_mask |= mask
 
-        if not passed:
-            break
+    return all_mask, none_mask, tuple(any_masks)
+
+
+def match_requirements(capabilities, requirements):
+    """
+    Matches hardware capabilities to port requirements.
+
+    capabilities can also be a mask from capabilities_mask.
+    """
+    if len(requirements) == 0:
+        return True
+
+    if not isinstance(capabilities, int):
+        capabilities = capabilities_mask(tuple(capabilities))
 
-    return passed
+    all_mask, none_mask, any_masks = compile_requirements(tuple(requirements))
+
+    if (capabilities & all_mask) != all_mask or (capabilities & none_mask):
+        return False
+
+    for mask in any_masks:
+        if not (capabilities & mask):
+            return False
+
+    return True
 
 
 class CancelEvent(HarbourException):
@@ -572,10 +647,59 @@ class Callback:
             pass
 
 
+class QueuedCallback(Callback):
+    """
+    A callback that can be handed to a worker thread.
+
+    Messages are queued up and replayed on the real callback from the main thread with drain(),
+    progress is just remembered so the main thread can combine it across workers.
+    """
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.messages = []
+        self.amount = 0
+        self.total = None
+
+    def progress(self, message, amount, total=None, fmt=None):
+        if self.was_cancelled:
+            raise CancelEvent()
+
+        if message is None:
+            return
+
+        with self.lock:
+            self.amount = amount
+            self.total = total
+
+    def message(self, message):
+        with self.lock:
+            self.messages.append(('message', message))
+
+    def message_box(self, message):
+        with self.lock:
+            self.messages.append(('message_box', message))
+
+    def do_cancel(self):
+        self.was_cancelled = True
+
+    def drain(self, callback):
+        """
+        Passes on any queued messages, this must be called from the main thread.
+        """
+        with self.lock:
+            messages = self.messages
+            self.messages = []
+
+        for method, message in messages:
+            getattr(callback, method)(message)
+
+
 __all__ = (
     'Callback',
     'CancelEvent',
     'HarbourException',
+    'QueuedCallback',
     'add_dict_list_unique',
     'add_list_unique',
     'add_pm_signature',
@@ -585,12 +709,15 @@ __all__ = (
     'fetch_json',
     'fetch_text',
     'get_dict_list',
+    'get_path_free',
     'get_path_fs',
     'hash_file',
     'json_safe_load',
     'json_safe_loads',
     'load_pm_signature',
     'make_temp_directory',
+    'capabilities_mask',
+    'compile_requirements',
     'match_requirements',
     'name_cleaner',
     'nice_size',
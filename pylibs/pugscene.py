@@ -1030,6 +1030,12 @@ class FiltersScene(BaseScene):
         genres = self.locked_genres + self.selected_genres
         total_ports = len(self.gui.hm.list_ports(genres))
 
+        ## Work out the counts for every filter we might show in one go.
+        facet_counts = self.gui.hm.port_facets(genres, [
+            hm_genre
+            for hm_genre in (list(harbourmaster.HM_GENRES) + ['rtr', 'mono', 'not installed'] + list(self.gui.hm.porters_list()))
+            if hm_genre not in genres])
+
         self.tags['filter_list'].bar_select_mode = 'full'
 
         first_add = True
@@ -1048,7 +1054,7 @@ class FiltersScene(BaseScene):
                 ports = total_ports
                 text = ["    ", "_CHECKED", f"  {filter_translation.get(hm_genre, hm_genre)}", None, "    ", f"  {ports} "]
             else:
-                ports = len(self.gui.hm.list_ports(genres + [hm_genre]))
+                ports = facet_counts[hm_genre]
                 text = ["    ", "_UNCHECKED", f"  {filter_translation.get(hm_genre, hm_genre)}", None, "    ", f"  {ports} "]
 
             if ports == 0:
@@ -1074,7 +1080,7 @@ class FiltersScene(BaseScene):
                 ports = total_ports
                 text = ["    ", "_CHECKED", f"  {filter_translation.get(hm_genre, hm_genre)}", None, "    ", f"  {ports}"]
             else:
-                ports = len(self.gui.hm.list_ports(genres + [hm_genre]))
+                ports = facet_counts[hm_genre]
                 text = ["    ", "_UNCHECKED", f"  {filter_translation.get(hm_genre, hm_genre)}", None, "    ", f"  {ports}"]
 
             if ports == 0:
@@ -1101,7 +1107,7 @@ class FiltersScene(BaseScene):
                 ports = total_ports
                 text = ["    ", "_CHECKED", f"  {filter_translation.get(hm_genre, hm_genre)}", None, "    ", f"  {ports}"]
             else:
-                ports = len(self.gui.hm.list_ports(genres + [hm_genre]))
+                ports = facet_counts[hm_genre]
                 text = ["    ", "_UNCHECKED", f"  {filter_translation.get(hm_genre, hm_genre)}", None, "    ", f"  {ports}"]
 
             if ports == 0:
@@ -37,7 +37,7 @@ def extract_requirements(text, strict=False):
 
 
 def theme_update(target, source):
-    capabilities = harbourmaster.device_info()['capabilities']
+    capabilities = harbourmaster.capabilities_mask(tuple(harbourmaster.device_info()['capabilities']))
 
     for key, value in source.items():
         key, requirements = extract_requirements(key)
@@ -63,7 +63,7 @@ def theme_merge(target, source):
 
 def theme_apply(gui, section_data, base_data, elements):
     new_data = {}
-    capabilities = harbourmaster.device_info()['capabilities']
+    capabilities = harbourmaster.capabilities_mask(tuple(harbourmaster.device_info()['capabilities']))
 
     for region_name, region_data in section_data.items():
         if region_name == "#base":
@@ -111,6 +111,7 @@ def theme_load(gui, theme_file, color_scheme=None):
         raise ValueError(f"Unable to load theme {theme_file}")
 
     capabilities = harbourmaster.device_info()["capabilities"]
+    capability_bits = harbourmaster.capabilities_mask(tuple(capabilities))
 
     base_data = {}
     elements = {}
@@ -176,7 +177,7 @@ def theme_load(gui, theme_file, color_scheme=None):
                 logger.debug("- loading elements:")
                 for element_name, element_data in section_data.items():
                     element_name, requirements = extract_requirements(element_name)
-                    if not harbourmaster.match_requirements(capabilities, requirements):
+                    if not harbourmaster.match_requirements(capability_bits, requirements):
                         continue
 
                     elements[element_name] = element_data
@@ -187,7 +188,7 @@ def theme_load(gui, theme_file, color_scheme=None):
                         if element_key != 'area':
                             continue
 
-                        if not harbourmaster.match_requirements(capabilities, requirements):
+                        if not harbourmaster.match_requirements(capability_bits, requirements):
                             continue
 
                         last_value = element_value
@@ -208,7 +209,7 @@ def theme_load(gui, theme_file, color_scheme=None):
         else:
             section_name, requirements = extract_requirements(section_name, strict=True)
             if requirements is not None:
-                if not harbourmaster.match_requirements(capabilities, requirements):
+                if not harbourmaster.match_requirements(capability_bits, requirements):
                     logger.debug(f"Not matched: {section_name} -> {capabilities}, {requirements}")
                     continue
 
@@ -351,6 +352,7 @@ class ThemeDownloader(harbourmaster.source.GitHubRawReleaseV1):
                 for file_name in self._images_dir.iterdir()
                 if file_name.suffix in ('.png', '.jpg')]
 
+            buffer = bytearray(harbourmaster.HM_EXTRACT_BUFFER_SIZE)
             with zipfile.ZipFile(images_zip, 'r') as zf:
                 for zip_name in zf.namelist():
                     if zip_name.casefold().rsplit('.')[-1] not in ('jpg', 'png'):
@@ -360,8 +362,7 @@ class ThemeDownloader(harbourmaster.source.GitHubRawReleaseV1):
                     if file_name not in images_to_delete:
                         logger.debug(f"adding {file_name}")
 
-                    with open(file_name, 'wb') as fh:
-                        fh.write(zf.read(zip_name))
+                    harbourmaster.zip_copy(zf, zip_name, file_name, buffer)
 
                     if file_name in images_to_delete:
                         images_to_delete.remove(file_name)
@@ -1,4 +1,5 @@
 
+import json
 import os
 import sys
 
@@ -16,6 +17,7 @@ am = AnsiMarkup(tags={
 
 __colorama = None
 __output_fh = None
+__json_output = False
 
 
 def to_str(data):
@@ -38,6 +40,19 @@ def do_cprint_output(file_handle):
     __output_fh = file_handle
 
 
+def do_json_output(mode):
+    """
+    In json mode cprint writes {"type": "text"} records, the commands write their own records with cprint_json.
+    """
+    global __json_output
+
+    __json_output = mode
+
+
+def json_output():
+    return __json_output
+
+
 def do_color(mode=None):
     global __colorama
 
@@ -55,21 +70,37 @@ def do_color(mode=None):
         __colorama = False
 
 
-def cprint(*args, **kwargs):
+def _color_func(kwargs):
     global __colorama
     global __output_fh
     if __colorama is None:
         do_color()
 
     if __output_fh is not None:
-        color_func = am.strip
-        kwargs.setdefault('file', __output_fh)
+        return am.strip
     elif 'file' in kwargs:
-        color_func = am.strip
+        return am.strip
     elif __colorama:
-        color_func = am.parse
+        return am.parse
     else:
-        color_func = am.strip
+        return am.strip
+
+
+def cprint(*args, **kwargs):
+    if __json_output:
+        text = kwargs.get('sep', ' ').join(
+            am.strip(to_str(arg))
+            for arg in args)
+
+        if text != '':
+            cprint_json({'type': 'text', 'text': text}, file=kwargs.get('file', None))
+
+        return
+
+    color_func = _color_func(kwargs)
+
+    if __output_fh is not None:
+        kwargs.setdefault('file', __output_fh)
 
     print(
         *(
@@ -77,12 +108,50 @@ def cprint(*args, **kwargs):
             for arg in args),
         **kwargs)
 
+
+def cformat(arg):
+    """
+    Returns arg the way cprint would print it right now, print it with cprint_raw.
+    """
+    return _color_func({})(to_str(arg))
+
+
+def cprint_colour():
+    """
+    Does cprint output colour right now?
+    """
+    return _color_func({}) is am.parse
+
+
+def cprint_raw(*args, **kwargs):
+    """
+    Same as cprint but without any markup, for json and the like.
+    """
+    if __output_fh is not None:
+        kwargs.setdefault('file', __output_fh)
+
+    print(*args, **kwargs)
+
+
+def cprint_json(record, file=None, **kwargs):
+    """
+    Writes record as one line of json, kwargs are passed on to json.dumps.
+    """
+    cprint_raw(json.dumps(record, **kwargs), file=file or __output_fh or sys.stdout, flush=True)
+
+
 def cstrip(arg):
     return am.strip(to_str(arg))
 
 __all__ = (
+    'cformat',
     'cprint',
+    'cprint_colour',
+    'cprint_json',
+    'cprint_raw',
     'cstrip',
     'do_color',
+    'do_json_output',
     'in_terminal',
+    'json_output',
     )
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+"""
+Checks the compiled port_info normaliser against the original port_info_load code.
+
+Run from the root of the repo:
+
+    python3 tools/port_info_check.py [iterations] [seed]
+
+It also reports anywhere the tables in harbourmaster/info.py and config.py have drifted from
+data/ports.schema.json.
+"""
+
+import copy
+import json
+import random
+import sys
+import time
+
+from pathlib import Path
+
+from loguru import logger
+
+sys.path.insert(0, str(Path('pylibs').absolute()))
+
+from harbourmaster.config import HM_GENRES
+from harbourmaster.info import PORT_INFO_ROOT_ATTRS, PORT_INFO_ATTR_ATTRS, PORT_INFO_NORMALISE
+
+
+def reference_normalise(info):
+    """
+    The body of port_info_load before it was compiled, the only change is the marked 'continue'.
+    """
+    if isinstance(info.get('attr', {}).get('porter'), str):
+        info['attr']['porter'] = [info['attr']['porter']]
+
+    if isinstance(info.get('attr', {}).get('reqs', None), dict):
+        info['attr']['reqs'] = [
+            key
+            for key in info['attr']['reqs']]
+
+    port_info = {}
+
+    for attr, attr_default in PORT_INFO_ROOT_ATTRS.items():
+        if isinstance(attr_default, (dict, list)):
+            attr_default = attr_default.copy()
+
+        port_info[attr] = info.get(attr, attr_default)
+
+    for attr, attr_default in PORT_INFO_ATTR_ATTRS.items():
+        if isinstance(attr_default, (dict, list)):
+            attr_default = attr_default.copy()
+
+        port_info['attr'][attr] = info.get('attr', {}).get(attr, attr_default)
+
+    for key in ('items', 'items_opt'):
+        if not isinstance(port_info[key], list):
+            continue
+
+        i = 0
+        while i < len(port_info[key]):
+            item = port_info[key][i]
+            if item.startswith('/'):
+                del port_info[key][i]
+                continue
+
+            if item.startswith('../'):
+                del port_info[key][i]
+                continue
+
+            if '/../' in item:
+                del port_info[key][i]
+                continue
+
+            if item == "":
+                del port_info[key][i]
+                ## The original was missing this, so the item after an empty one was never checked.
+                continue
+
+            i += 1
+
+        if key == 'items_opt' and port_info['items_opt'] == []:
+            port_info['items_opt'] = None
+
+    if isinstance(port_info['attr'].get('genres', None), list):
+        genres = port_info['attr']['genres']
+        port_info['attr']['genres'] = []
+
+        for genre in genres:
+            if genre.casefold() in HM_GENRES:
+                port_info['attr']['genres'].append(genre.casefold())
+
+    return port_info
+
+
+ITEMS = [
+    "Port.sh", "Port/", "Port Two.sh", "/etc/passwd", "../escape", "a/../b", "a/..", "..", "",
+    "./Port.sh", "Port/../../x", "..hidden", "dir/", "Üñï.sh",
+    ]
+
+GENRES = HM_GENRES + ["Action", "FPS", "Visual Novel", "rhythm", "nope", "", "ACTION"]
+
+
+def random_list(choices, max_length=5):
+    return random.choices(choices, k=random.randint(0, max_length))
+
+
+def random_info():
+    info = {}
+
+    if random.random() < 0.9:
+        info['version'] = random.choice([2, 3])
+
+    if random.random() < 0.9:
+        info['name'] = random.choice(["port.zip", "Some Port.zip", ""])
+
+    if random.random() < 0.9:
+        info['items'] = random_list(ITEMS)
+
+    roll = random.random()
+    if roll < 0.3:
+        info['items_opt'] = None
+    elif roll < 0.8:
+        info['items_opt'] = random_list(ITEMS)
+
+    if random.random() < 0.3:
+        info['status'] = {'source': "Unknown", 'md5': None, 'status': "Installed"}
+
+    if random.random() < 0.2:
+        info['files'] = {'port.json': "Port/port.json"}
+
+    if random.random() < 0.2:
+        info['install_size'] = random.randint(0, 1 << 30)
+
+    if random.random() < 0.2:
+        info['extra_key'] = "dropped"
+
+    if random.random() < 0.95:
+        attr = info['attr'] = {}
+        keys = list(PORT_INFO_ATTR_ATTRS) + ['arch', 'extra']
+        random.shuffle(keys)
+
+        for key in keys:
+            if random.random() < 0.2:
+                continue
+
+            if key == 'porter':
+                attr[key] = random.choice(["bob", ["bob", "alice"], [], None])
+            elif key == 'reqs':
+                attr[key] = random.choice([[], ["opengl"], {"opengl": 1, "power": 2}, ["!lowres", "4:3|16:9"]])
+            elif key == 'genres':
+                attr[key] = random.choice([random_list(GENRES), None])
+            elif key == 'image':
+                attr[key] = random.choice([{}, {'screenshot': "screenshot.png"}, None])
+            elif key == 'rtr':
+                attr[key] = random.choice([True, False])
+            elif key == 'runtime':
+                attr[key] = random.choice([None, "frt_3.5.2.squashfs", "mono-6.12.0.122-aarch64.squashfs"])
+            else:
+                attr[key] = random.choice(["", "Some text", "Ünïcödé"])
+
+    return info
+
+
+def run(function, info):
+    try:
+        result = function(info)
+
+    except Exception as err:
+        return ('error', type(err).__name__), info
+
+    ## Both the result and what happened to the input have to match.
+    return json.dumps(result), json.dumps(info)
+
+
+def check_schema():
+    with open('data/ports.schema.json', 'r') as fh:
+        schema = json.load(fh)['definitions']
+
+    root_keys = set(schema['port']['properties']) | set(schema['port_install']['allOf'][1]['properties'])
+    attr_keys = set(schema['port_attr']['properties'])
+    genres = set(schema['port_genre']['enum'])
+
+    drift = []
+    for name, ours, theirs in (
+            ('root keys', set(PORT_INFO_ROOT_ATTRS), root_keys),
+            ('attr keys', set(PORT_INFO_ATTR_ATTRS), attr_keys),
+            ('genres', set(HM_GENRES), genres)):
+
+        if ours - theirs:
+            drift.append(f"{name} not in the schema: {', '.join(sorted(ours - theirs))}")
+
+        if name == 'genres' and theirs - ours:
+            drift.append(f"{name} only in the schema: {', '.join(sorted(theirs - ours))}")
+
+    for line in drift:
+        print(f"schema drift: {line}")
+
+
+def main(argv):
+    iterations = int(argv[1]) if len(argv) > 1 else 20000
+    seed = int(argv[2]) if len(argv) > 2 else 0
+
+    random.seed(seed)
+
+    ## Bad items get logged, which would drown everything else out.
+    logger.remove()
+
+    check_schema()
+
+    failures = 0
+    infos = [random_info() for i in range(iterations)]
+
+    for info in infos:
+        expected = run(reference_normalise, copy.deepcopy(info))
+        result = run(PORT_INFO_NORMALISE, copy.deepcopy(info))
+
+        if expected != result:
+            failures += 1
+            if failures <= 5:
+                print(f"MISMATCH: {json.dumps(info)}")
+                print(f"  expected: {expected}")
+                print(f"  result:   {result}")
+
+    for name, function in (('reference', reference_normalise), ('compiled', PORT_INFO_NORMALISE)):
+        test_infos = copy.deepcopy(infos)
+        start = time.perf_counter()
+        for info in test_infos:
+            try:
+                function(info)
+            except Exception:
+                pass
+
+        print(f"{name}: {(time.perf_counter() - start) / len(infos) * 1_000_000:.2f}us per port")
+
+    print(f"{iterations - failures}/{iterations} matched.")
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv))